@@ -1,28 +1,44 @@
 """Contains classes that represent a collection of addresses."""
 
-import re
+import bisect, re, socket, struct, sys, functools, threading
+from array import array
+from collections import OrderedDict
 
 class InvalidAddressError(Exception):
     """The format of the given address was not recognized."""
     pass
 
 
+# binary representations of the addresses, in network byte order
+_IP4 = struct.Struct("!I")
+_IP6 = struct.Struct("!QQ")
+_LOW64 = (1 << 64) - 1
+_inet_pton4 = functools.partial(socket.inet_pton, socket.AF_INET)
+_inet_pton6 = functools.partial(socket.inet_pton, socket.AF_INET6)
+# type code of the arrays of IPv4 addresses
+_UINT32 = "I" if array("I").itemsize == 4 else "L"
+# decimal representations of the octets of an IPv4 address
+_OCTETS = [str(octet) for octet in range(256)]
+
+
 def _format_ip4(addr):
     """Return a string holding the human-friendly version of the IPv4
     address *addr* in an integer representation.
     """
-    res = ""
-    res = res + str(addr >> 24) + "."
-    res = res + str((addr >> 16) & 0xff) + "."
-    res = res + str((addr >> 8) & 0xff) + "."
-    res = res + str(addr & 0xff)
-    return res
+    return (_OCTETS[addr >> 24] + "." + _OCTETS[(addr >> 16) & 0xff] + "."
+        + _OCTETS[(addr >> 8) & 0xff] + "." + _OCTETS[addr & 0xff])
 
 
 def _parse_ip4(addr):
     """Return the integer representation of the given address *addr* in a
     human-friendly format (255.255.255.255).
     """
+    # inet_pton only accepts the canonical format, anything else is parsed
+    # below
+    try:
+        return _IP4.unpack(_inet_pton4(addr))[0]
+    except (socket.error, TypeError, ValueError):
+        pass
     match = re.match(r"([0-9]{1,3})\." * 3 + r"([0-9]{1,3})", addr)
     if match is None:
         raise InvalidAddressError("Invalid IPv4 address: " + addr)
@@ -37,7 +53,86 @@ def _parse_ip4(addr):
     return res
 
 
-class Ip4Range:
+def parse_ip4_many(addrs):
+    """Return an array of the integer representations of the IPv4 addresses
+    *addrs*."""
+    try:
+        res = array(_UINT32, "".join(map(_inet_pton4, addrs)))
+    except (socket.error, TypeError, ValueError):
+        return array(_UINT32, map(_parse_ip4, addrs))
+    if sys.byteorder == "little":
+        res.byteswap()
+    return res
+
+
+def format_ip4_many(addrs):
+    """Return the list of the human-friendly versions of the IPv4 addresses
+    *addrs* in integer representation."""
+    return map(_format_ip4, addrs)
+
+
+def _slice_bounds(slc, size):
+    """Return the start, stop and step offsets of the slice *slc* of a range
+    of *size* addresses, which may not fit in slice.indices()."""
+    step = slc.step or 1
+    if step <= 0:
+        raise ValueError("Address range slices must have a positive step")
+    bounds = []
+    for value, default in ((slc.start, 0), (slc.stop, size)):
+        if value is None:
+            value = default
+        elif value < 0:
+            value = max(value + size, 0)
+        bounds.append(min(value, size))
+    return bounds[0], max(bounds[0], bounds[1]), step
+
+
+class AddrSlice(object):
+    """Lazy slice of an IPv4 or IPv6 subnet, it only holds its bounds."""
+
+    def __init__(self, addr_range, start, stop, step=1):
+        self.addr_range = addr_range
+        self.start = start
+        self.stop = stop
+        self.step = step
+
+    def __iter__(self):
+        """Iterator over the addresses of the slice."""
+        if self.step == 1:
+            return self.addr_range.iter_from(self.start, self.stop)
+        return (self.addr_range[ind]
+            for ind in _count(self.start, self.stop, self.step))
+
+    def len(self):
+        """Return the number of addresses in this slice."""
+        return (self.stop - self.start + self.step - 1) // self.step
+
+    def __len__(self):
+        return self.len()
+
+    def __nonzero__(self):
+        return self.stop > self.start
+
+    def __getitem__(self, ind):
+        """Return the formatted address at index *ind* of the slice."""
+        if isinstance(ind, slice):
+            start, stop, step = _slice_bounds(ind, self.len())
+            return AddrSlice(self.addr_range, self.start + start * self.step,
+                self.start + stop * self.step, self.step * step)
+        if ind < 0 or ind >= self.len():
+            raise IndexError()
+        return self.addr_range[self.start + ind * self.step]
+
+
+def _count(start, stop, step=1):
+    """Iterate from *start* to *stop* like xrange() but also with values that
+    do not fit in a C long."""
+    while start < stop:
+        yield start
+        start += step
+
+
+class Ip4Range(object):
     """Represents an IPv4 subnet."""
 
     range_type = 'ip4'
@@ -47,6 +142,11 @@ class Ip4Range:
         """Returns a sortable representation of an address from this range."""
         return _parse_ip4(addr.addr)
 
+    def sortables(self, addrs):
+        """Returns the sortable representations of a list of addresses from
+        this range."""
+        return parse_ip4_many([addr.addr for addr in addrs])
+
     def __init__(self, iprange):
         """Initialize the range with the given subnet *iprange* with format
         x.x.x.x/x."""
@@ -64,7 +164,14 @@ class Ip4Range:
 
     def __iter__(self):
         """Iterator over the IPv4 subnet."""
-        for i in xrange(self.net, self.net + 2 ** (32 - self.mask)):
+        return self.iter_from()
+
+    def iter_from(self, start=0, stop=None):
+        """Iterator over the IPv4 subnet from the index *start* to the index
+        *stop* excluded."""
+        if stop is None:
+            stop = self.len()
+        for i in xrange(self.net + start, self.net + stop):
             yield _format_ip4(i)
 
     def __contains__(self, addr):
@@ -83,13 +190,25 @@ class Ip4Range:
         """Return the number of addresses in this subnet."""
         return self.len()
 
+    def __nonzero__(self):
+        return True
+
     def __getitem__(self, ind):
-        """Return the formatted addresses at index *n* from the subnet."""
+        """Return the formatted addresses at index *n* from the subnet, or a
+        lazy slice of the subnet."""
+        if isinstance(ind, slice):
+            return AddrSlice(self, *_slice_bounds(ind, self.len()))
         # Allow the use of random.choice(Ip4Range)
         if ind < 0 or ind >= 2 ** (32 - self.mask):
             raise IndexError()
         return _format_ip4(self.net + ind)
 
+    def index(self, addr):
+        """Return the index of the address *addr* in the subnet."""
+        if addr not in self:
+            raise ValueError(addr + " is not in the subnet " + str(self))
+        return _parse_ip4(addr) - self.net
+
     def __str__(self):
         """Return a human-readable representation of the subnet."""
         return _format_ip4(self.net) + "/" + str(self.mask)
@@ -99,20 +218,22 @@ def _format_ip6(addr):
     """Return a string holding the human-friendly version of the IPv6
     address *addr* in an integer representation.
     """
-    power = 112
-    res = ""
-    while power > 0:
-        # in format strings the arguments must be numbered before python2.7
-        res = res + "{0:04x}".format((addr >> power) & 0xffff) + ":"
-        power = power - 16
-    res = res + "{0:04x}".format(addr & 0xffff)
-    return res
+    res = "%032x" % addr
+    return ":".join([res[0:4], res[4:8], res[8:12], res[12:16], res[16:20],
+        res[20:24], res[24:28], res[28:32]])
 
 
 def _parse_ip6(addr):
     """Return the integer representation of the given address *addr* in a
     human-friendly format (19af:1234::abcd).
     """
+    # inet_pton also accepts an embedded IPv4 address, parsed differently below
+    if "." not in addr:
+        try:
+            high, low = _IP6.unpack(_inet_pton6(addr))
+            return high << 64 | low
+        except (socket.error, TypeError, ValueError):
+            pass
     if addr == "::":
         addr = (":0" * 8)[1:] # strip the initial ':'
     elif addr.find("::") >= 0:
@@ -140,7 +261,41 @@ def _parse_ip6(addr):
     return res
 
 
-class Ip6Range:
+def _eui64(mac):
+    """Return the modified EUI-64 interface identifier of the MAC address
+    *mac*."""
+    digits = re.sub("[-:.]", "", mac)
+    if not re.match("[0-9a-fA-F]{12}$", digits):
+        raise InvalidAddressError("Invalid MAC address: " + mac)
+    value = int(digits, 16)
+    # insert fffe in the middle and flip the universal/local bit
+    return ((value >> 24) << 40 | 0xfffe << 24 | value & 0xffffff) ^ (1 << 57)
+
+
+def parse_ip6_many(addrs):
+    """Return the list of the integer representations of the IPv6 addresses
+    *addrs*."""
+    return map(_parse_ip6, addrs)
+
+
+def format_ip6_many(addrs):
+    """Return the list of the human-friendly versions of the IPv6 addresses
+    *addrs* in integer representation."""
+    return map(_format_ip6, addrs)
+
+
+def addr_key(addr):
+    """Return a key of 32 hexadecimal digits of the IPv4 or IPv6 address
+    *addr*, ordered as the addresses, or None if it is not an IP address."""
+    try:
+        if ":" in addr:
+            return "%032x" % _parse_ip6(addr)
+        return "%032x" % _parse_ip4(addr)
+    except InvalidAddressError:
+        return None
+
+
+class Ip6Range(object):
     """Represents an IPv6 subnet."""
 
     range_type = "ip6"
@@ -150,6 +305,11 @@ class Ip6Range:
         """Returns a sortable representation of an address from this range."""
         return _parse_ip6(addr.addr)
 
+    def sortables(self, addrs):
+        """Returns the sortable representations of a list of addresses from
+        this range."""
+        return parse_ip6_many([addr.addr for addr in addrs])
+
     def __init__(self, iprange):
         """Initialize the range with the given subnet *iprange* with format
         12ab:34cd::89ef/x.
@@ -167,11 +327,25 @@ class Ip6Range:
 
     def __iter__(self):
         """Iterator over the IPv6 subnet."""
-        # IPv6 addresses are too big for xrange()
-        i = self.net
-        while i < self.net + 2 ** (128 - self.mask):
-            yield _format_ip6(i)
-            i = i + 1
+        return self.iter_from()
+
+    def iter_from(self, start=0, stop=None):
+        """Iterator over the IPv6 subnet from the index *start* to the index
+        *stop* excluded."""
+        if stop is None:
+            stop = self.len()
+        start += self.net
+        stop += self.net
+        while start < stop:
+            # only the 64 low bits change inside a /64
+            high = start >> 64
+            prefix = _format_ip6(high << 64)[:20]
+            for low in _count(start & _LOW64, min(stop - (high << 64),
+                    1 << 64)):
+                low = "%016x" % low
+                yield (prefix + low[0:4] + ":" + low[4:8] + ":" + low[8:12]
+                    + ":" + low[12:16])
+            start = (high + 1) << 64
 
     def __contains__(self, addr):
         """Return true if the given *addr* belongs to this subnet."""
@@ -186,56 +360,126 @@ class Ip6Range:
         return 2 ** (128 - self.mask)
 
     def __len__(self):
-        """Return the number of addresses in this subnet."""
+        """Return the number of addresses in this subnet, len() must be used
+        instead for subnets larger than sys.maxsize such as a /64."""
         return self.len()
 
+    def __nonzero__(self):
+        return True
+
     def __getitem__(self, ind):
-        """Return the formatted addresses at index *n* from the subnet."""
+        """Return the formatted addresses at index *n* from the subnet, or a
+        lazy slice of the subnet."""
+        if isinstance(ind, slice):
+            return AddrSlice(self, *_slice_bounds(ind, self.len()))
         # Allow the use of random.choice(Ip6Range)
         if ind < 0 or ind >= 2 ** (128 - self.mask):
             raise IndexError()
         return _format_ip6(self.net + ind)
 
+    def index(self, addr):
+        """Return the index of the address *addr* in the subnet."""
+        if addr not in self:
+            raise ValueError(addr + " is not in the subnet " + str(self))
+        return _parse_ip6(addr) - self.net
+
+    def eui64(self, mac):
+        """Return the address of the subnet derived from the MAC address *mac*
+        with the modified EUI-64 format."""
+        if self.mask > 64:
+            raise InvalidAddressError("EUI-64 addresses need a /64 or larger "
+                + "subnet: " + str(self))
+        return _format_ip6(self.net | _eui64(mac))
+
     def __str__(self):
         """Return a human-readable representation of the subnet."""
         return _format_ip6(self.net) + "/" + str(self.mask)
 
 
+def _set_key(addr):
+    """Return the sort key of the address *addr* of an *AddrSet*: the IP
+    addresses come first in address order, then the other names."""
+    key = addr_key(addr)
+    if key is None:
+        return (1, "", addr)
+    return (0, key, addr)
+
+
 class AddrSet:
     """Represent a generic set of addresses. The addresses must be added
-    manually.
+    manually, they are kept sorted so that they have a stable order and are
+    found by bisection.
     """
 
     range_type = "set"
 
     def sortable(self, addr):
         """Returns a sortable representation of an address from this range."""
-        return addr.addr
+        return _set_key(addr.addr)
+
+    def sortables(self, addrs):
+        """Returns the sortable representations of a list of addresses from
+        this range."""
+        return [_set_key(addr.addr) for addr in addrs]
 
     def __init__(self, addr_set=None, dns_record="A"):
         """Initialize a new address set of DNS record type *dns_record*."""
-        self.addr_set = addr_set
-        if self.addr_set is None:
-            self.addr_set = set()
+        self.keys = sorted(_set_key(addr) for addr in set(addr_set or ()))
+        self.addrs = [key[2] for key in self.keys]
         self.dns_record = dns_record
+        self.shared = False
+
+    def copy(self):
+        """Return a copy of the set. The addresses are only copied when one of
+        the sets is modified."""
+        res = AddrSet(dns_record=self.dns_record)
+        res.keys = self.keys
+        res.addrs = self.addrs
+        self.shared = res.shared = True
+        return res
+
+    def _unshare(self):
+        """Copy the addresses before modifying them if they are shared."""
+        if self.shared:
+            self.keys = list(self.keys)
+            self.addrs = list(self.addrs)
+            self.shared = False
+
+    def _find(self, addr):
+        """Return the position of the address *addr*, or -1."""
+        key = _set_key(addr)
+        idx = bisect.bisect_left(self.keys, key)
+        if idx < len(self.keys) and self.keys[idx] == key:
+            return idx
+        return -1
 
     def add(self, addr):
         """Add the address *addr* to the set."""
-        self.addr_set.add(addr)
+        key = _set_key(addr)
+        idx = bisect.bisect_left(self.keys, key)
+        if idx == len(self.keys) or self.keys[idx] != key:
+            self._unshare()
+            self.keys.insert(idx, key)
+            self.addrs.insert(idx, addr)
 
     def remove(self, addr):
         """Remove the address *addr* from the set."""
-        self.addr_set.remove(addr)
+        idx = self._find(addr)
+        if idx < 0:
+            raise KeyError(addr)
+        self._unshare()
+        del self.keys[idx]
+        del self.addrs[idx]
 
     def __contains__(self, addr):
-        return addr in self.addr_set
+        return self._find(addr) >= 0
 
     def __iter__(self):
-        return iter(self.addr_set)
+        return iter(self.addrs)
 
     def len(self):
         """Return the number of elements in the set."""
-        return len(self.addr_set)
+        return len(self.addrs)
 
     def __len__(self):
         return self.len()
@@ -243,14 +487,73 @@ class AddrSet:
     def __getitem__(self, ind):
         if ind < 0 or ind >= len(self):
             raise IndexError()
-        for addr in self:
-            if (ind == 0):
-                return addr
-            ind = ind - 1
+        return self.addrs[ind]
+
+    def index(self, addr):
+        """Return the index of the address *addr* in the sorted set."""
+        idx = self._find(addr)
+        if idx < 0:
+            raise ValueError(addr + " is not in the set")
+        return idx
 
     def __str__(self):
-        res = ""
-        for elm in self.addr_set:
-            res = res + "," + str(elm)
-        # skip the first comma
-        return res[1:]
+        return ",".join(str(elm) for elm in self.addrs)
+
+
+class RangeCache:
+    """Bounded LRU cache of the parsed address ranges. The cached subnets are
+    shared by all their users and must not be modified, the address sets are
+    returned as copies which may be modified."""
+
+    def __init__(self, size=256):
+        """Keep at most *size* parsed ranges."""
+        self.size = size
+        self.ranges = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, range_type, definition, dns_record="A"):
+        """Return the range of type *range_type* ("ip4", "ip6" or "set")
+        serialized as *definition*, parsing it only if it is not cached."""
+        key = (range_type, definition, dns_record)
+        with self.lock:
+            addr_range = self.ranges.pop(key, None)
+            if addr_range is not None:
+                self.hits += 1
+                self.ranges[key] = addr_range
+            else:
+                self.misses += 1
+        if addr_range is None:
+            addr_range = parse_range(range_type, definition, dns_record)
+            with self.lock:
+                self.ranges[key] = addr_range
+                while len(self.ranges) > self.size:
+                    self.ranges.popitem(last=False)
+                    self.evictions += 1
+        if range_type == "set":
+            return addr_range.copy()
+        return addr_range
+
+    def clear(self):
+        """Drop all the cached ranges and reset the counters."""
+        with self.lock:
+            self.ranges.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+def parse_range(range_type, definition, dns_record="A"):
+    """Return a new range of type *range_type* ("ip4", "ip6" or "set")
+    serialized as *definition*."""
+    if range_type == "ip4":
+        return Ip4Range(definition)
+    elif range_type == "ip6":
+        return Ip6Range(definition)
+    addrset = []
+    if definition:
+        addrset = str(definition).split(",")
+    return AddrSet(addrset, dns_record)
+
+
+RANGE_CACHE = RangeCache()
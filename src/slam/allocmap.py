@@ -0,0 +1,116 @@
+"""Compact index of the allocated addresses of a pool."""
+
+import bisect
+
+
+class AllocMap:
+    """Set of allocated offsets inside an address range. The offsets are stored
+    as a sorted list of disjoint intervals so that sequential allocations only
+    take a few bytes whatever their number.
+    """
+
+    def __init__(self, definition=""):
+        """Restore the map from its serialized *definition* with format
+        first-last,offset,first-last."""
+        self.starts = []
+        self.ends = []
+        self.count = 0
+        if definition:
+            for interval in definition.split(","):
+                first, _, last = interval.partition("-")
+                first = int(first)
+                if last:
+                    last = int(last)
+                else:
+                    last = first
+                self.starts.append(first)
+                self.ends.append(last)
+                self.count += last - first + 1
+
+    def __contains__(self, offset):
+        """Return true if the address at *offset* is allocated."""
+        idx = bisect.bisect_right(self.starts, offset) - 1
+        return idx >= 0 and offset <= self.ends[idx]
+
+    def add(self, offset):
+        """Mark the address at *offset* as allocated."""
+        idx = bisect.bisect_right(self.starts, offset) - 1
+        if idx >= 0 and offset <= self.ends[idx]:
+            return
+        merge_prev = idx >= 0 and self.ends[idx] == offset - 1
+        merge_next = (idx + 1 < len(self.starts)
+            and self.starts[idx + 1] == offset + 1)
+        if merge_prev and merge_next:
+            self.ends[idx] = self.ends[idx + 1]
+            del self.starts[idx + 1]
+            del self.ends[idx + 1]
+        elif merge_prev:
+            self.ends[idx] = offset
+        elif merge_next:
+            self.starts[idx + 1] = offset
+        else:
+            self.starts.insert(idx + 1, offset)
+            self.ends.insert(idx + 1, offset)
+        self.count += 1
+
+    def remove(self, offset):
+        """Mark the address at *offset* as available."""
+        idx = bisect.bisect_right(self.starts, offset) - 1
+        if idx < 0 or offset > self.ends[idx]:
+            return
+        first, last = self.starts[idx], self.ends[idx]
+        if first == last:
+            del self.starts[idx]
+            del self.ends[idx]
+        elif offset == first:
+            self.starts[idx] = offset + 1
+        elif offset == last:
+            self.ends[idx] = offset - 1
+        else:
+            self.ends[idx] = offset - 1
+            self.starts.insert(idx + 1, offset + 1)
+            self.ends.insert(idx + 1, last)
+        self.count -= 1
+
+    def first_free(self, size, start=0):
+        """Return the first available offset greater or equal to *start* in a
+        range of *size* addresses, or None if there is none."""
+        idx = bisect.bisect_right(self.starts, start) - 1
+        if idx >= 0 and start <= self.ends[idx]:
+            # intervals are merged, the next offset is always available
+            start = self.ends[idx] + 1
+        if start >= size:
+            return None
+        return start
+
+    def nth_free(self, nth):
+        """Return the offset of the *nth* available address (starting at 0)."""
+        prev = 0
+        for first, last in zip(self.starts, self.ends):
+            if nth < first - prev:
+                break
+            nth -= first - prev
+            prev = last + 1
+        return prev + nth
+
+    def len(self):
+        """Return the number of allocated offsets."""
+        return self.count
+
+    def __len__(self):
+        return self.len()
+
+    def __eq__(self, other):
+        return self.starts == other.starts and self.ends == other.ends
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        res = []
+        for first, last in zip(self.starts, self.ends):
+            if first == last:
+                res.append(str(first))
+            else:
+                res.append(str(first) + "-" + str(last))
+        return ",".join(res)
@@ -2,9 +2,20 @@
 generation.
 """
 
-import sys, os, re, datetime, shutil
+import sys, os, re, datetime, shutil, json, tempfile, itertools, mmap
+import copy, glob, hashlib
+from django.conf import settings
 from django.db import models
 from slam.models import SLAMBaseModel
+from slam import addrrange
+
+
+# number of records joined in a single write to the output
+WRITE_BATCH = 4096
+# size of the chunks copied between files
+COPY_BUFSIZE = 1 << 16
+# size above which a rendered configuration is spooled to disk
+SPOOL_SIZE = 1 << 20
 
 
 class DuplicateRecordError(Exception):
@@ -12,6 +23,113 @@ class DuplicateRecordError(Exception):
     pass
 
 
+# generator classes by configuration type, as stored in the database
+GENERATORS = {}
+# generator classes by format name, as given to the interfaces
+FORMATS = {}
+
+
+def register(cls):
+    """Register the proxy of Config *cls* for its configuration type *type_*
+    and its format name *format_*. It can be used as a class decorator to add
+    site-specific generators."""
+    GENERATORS[cls.type_] = cls
+    FORMATS[cls.format_] = cls
+    return cls
+
+
+def cast(config):
+    """Return the *config* as an instance of the generator class registered
+    for its configuration type, or None if the type is unknown."""
+    cls = GENERATORS.get(config.conftype)
+    if cls is None:
+        return None
+    config.__class__ = cls
+    return config
+
+
+# version of the records parsed from the checkfiles, to increment whenever
+# the parsing changes so that the cached records are parsed again
+CHECKFILE_FORMAT = 1
+
+
+class CheckfileCache:
+    """On-disk cache of the parsed checkfiles, stored as one JSON file per
+    checkfile in the directory given by the CHECKFILE_CACHE setting. An entry
+    is kept by generator type and path and is valid while the modification
+    time, size and inode of the file and the CHECKFILE_FORMAT do not change.
+    The least recently used entries are evicted beyond CHECKFILE_CACHE_SIZE
+    entries."""
+
+    def __init__(self):
+        self.path = getattr(settings, "CHECKFILE_CACHE",
+            os.path.join(os.path.expanduser("~"), ".cache", "slam",
+                "checkfiles"))
+        self.size = getattr(settings, "CHECKFILE_CACHE_SIZE", 64)
+
+    @staticmethod
+    def _stamp(filename):
+        """Return the values identifying the current version of a file."""
+        stat = os.stat(filename)
+        return [stat.st_mtime, stat.st_size, stat.st_ino, stat.st_dev]
+
+    def _entry_path(self, conftype, filename):
+        """Return the path of the cache entry of a checkfile."""
+        key = conftype + ":" + os.path.abspath(filename)
+        return os.path.join(self.path,
+            hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, conftype, filename):
+        """Return the records of the file, or None if they are not cached or
+        if the file changed since."""
+        if not self.path:
+            return None
+        entry_path = self._entry_path(conftype, filename)
+        try:
+            stamp = self._stamp(filename)
+            with open(entry_path) as entryfile:
+                entry = json.load(entryfile)
+            if (entry["stamp"] != stamp
+                    or entry.get("format") != CHECKFILE_FORMAT):
+                return None
+            # the modification time of an entry is the time of its last use
+            os.utime(entry_path, None)
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+        return entry["records"]
+
+    def set(self, conftype, filename, records):
+        """Store the records of the current version of the file and evict the
+        least recently used entries."""
+        if not self.path:
+            return
+        # the cache is only an optimization, errors are ignored
+        try:
+            stamp = self._stamp(filename)
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            handle, tmppath = tempfile.mkstemp(dir=self.path)
+        except OSError:
+            return
+        try:
+            with os.fdopen(handle, "w") as entryfile:
+                json.dump({"format": CHECKFILE_FORMAT, "stamp": stamp,
+                    "records": records}, entryfile)
+            os.rename(tmppath, self._entry_path(conftype, filename))
+        except (IOError, OSError, ValueError):
+            os.unlink(tmppath)
+            return
+        try:
+            entries = [os.path.join(self.path, name)
+                for name in os.listdir(self.path) if name.endswith(".json")]
+            if len(entries) > self.size:
+                entries.sort(key=os.path.getmtime)
+                for entry_path in entries[:len(entries) - self.size]:
+                    os.unlink(entry_path)
+        except OSError:
+            pass
+
+
 class Config(SLAMBaseModel):
     """Default behaviors for generator classes."""
 
@@ -24,6 +142,10 @@ class Config(SLAMBaseModel):
     )
 
     comment = "#"
+    # true if the last generation left the output file untouched
+    unchanged = False
+    # true if the output is a file replaced by a new one on every generation
+    atomic = False
     conftype = models.CharField(max_length=6, choices=CONFIG_TYPE)
     default = models.BooleanField()
     outputfile = models.TextField()
@@ -33,12 +155,16 @@ class Config(SLAMBaseModel):
     name = models.CharField(max_length=50)
     timeout = models.CharField(max_length=10, blank=True, null=True)
     domain = models.TextField(blank=True, null=True)
+    revision = models.IntegerField(blank=True, null=True)
+    # modification time and size of the check files of the last generation
+    checkfile_stamps = models.TextField(blank=True, null=True)
 
     @classmethod
     def create(cls, childcls=None, name="", default=False, domain="",
             outputfile=None, header=None, footer=None, checkfile=None,
-            update=False):
-        """Initialize the input and output streams."""
+            update=False, timeout=None):
+        """Initialize the input and output streams. The *timeout* is only used
+        by the generators of DNS records."""
 
         # This condition and the *childcls* have been added because I could not
         # find a way to properly call this method from an overidden inherited
@@ -66,14 +192,19 @@ class Config(SLAMBaseModel):
         self.header = None
         self.footer = None
         self.check = None
+        self.atomic = False
         if not self.outputfile:
             self.output = None
         elif self.outputfile == "-":
             self.output = sys.stdout
-        elif os.access(self.outputfile, os.R_OK | os.W_OK):
-            self.output = open(self.outputfile, "r+")
         else:
-            self.output = open(self.outputfile, "w")
+            # the file is only read, a new file is renamed over it once
+            # generated
+            self.atomic = True
+            if os.access(self.outputfile, os.R_OK):
+                self.output = open(self.outputfile, "r")
+            else:
+                self.output = None
 
         if self.headerfile:
             self.header = open(self.headerfile, "r")
@@ -81,84 +212,125 @@ class Config(SLAMBaseModel):
             self.footer = open(self.footerfile, "r")
 
     def gen_header(self, header):
-        """Copy the header to the output stream."""
-        if not "output" in dir(self) or not self.output:
+        """Copy the header file or lines to the output stream."""
+        if (not "output" in dir(self) or not self.output) and not self.atomic:
             self.load()
 
-        for line in header:
-            self.output.write(line)
+        _copy(header, self.output)
 
     def gen_footer(self, footer):
-        """Copy the footer to the output stream."""
-        if not "output" in dir(self) or not self.output:
+        """Copy the footer file or lines to the output stream."""
+        if (not "output" in dir(self) or not self.output) and not self.atomic:
             self.load()
 
-        for line in footer:
-            self.output.write(line)
+        _copy(footer, self.output)
 
     def generate(self, hosts):
-        """Generate the actual content of the file."""
-        pass
+        """Write the records of the *hosts* to the output stream, joining them
+        by batches of WRITE_BATCH records."""
+        records = self.records(hosts)
+        while True:
+            batch = "".join(itertools.islice(records, WRITE_BATCH))
+            if not batch:
+                break
+            self.output.write(batch)
+
+    def records(self, hosts):
+        """Return an iterator over the configuration lines of the *hosts*."""
+        # implemented in child classes
+        return iter(())
 
     def _strip_slam_section(self, content):
         """Return the *content* with the slam section blanked to avoid
         false-positive in checkfile."""
-        slambegin = (self.comment + " This section will be automatically "
-            + "generated by SLAM any manual change will\n"
-            + self.comment + " be overwritten on the next generation of this "
-            + "file.\n")
-        slamend = (self.comment + " END of section automatically generated by "
-            + "SLAM\n")
-
-        if slambegin not in content or slamend not in content:
+        _, slamend = _markers(self.comment)
+        begin, end = _slam_section(content, self.comment)
+        if begin < 0 or end < 0:
             return content
 
-        res = content[:content.find(slambegin)]
-        res += "\n" * content[content.find(slambegin)
-            :content.find(slamend) + len(slamend)].count("\n")
-        res += content[content.find(slamend) + len(slamend):]
-
-        return res
+        end += len(slamend)
+        return (content[:begin] + "\n" * content.count("\n", begin, end)
+            + content[end:])
 
     def is_unique(self, hosts):
         """Check if all the hosts from *hosts* are not yet declared in the
         configurations files specified in *self.checkfile*. A list of duplicate
         records is returned."""
-        if not "output" in dir(self) or not self.output:
+        if (not "output" in dir(self) or not self.output) and not self.atomic:
             self.load()
 
         if not self.checkfile:
             return True
 
-        res = []
-        if not self.check:
-            self.check = []
-            for filename in self.checkfile.split(", "):
-                file_ = open(filename, "r")
-                content = self._strip_slam_section(file_.read())
-                linenum = 1
-                for line in content.split("\n"):
-                    if self.comment in line:
-                        line = line[:line.find(self.comment)]
-                    if line:
-                        for host, addr, _, _ in hosts:
-                            if not host.name:
-                                continue
-                            if not self._unique_host(line, host, addr):
-                                res.append((host, file_.name, linenum))
-                    linenum += 1
-                file_.close()
+        if getattr(self, "check", None) is None:
+            self._index_checkfiles()
 
+        res = []
+        for idx, (host, addr, _, _) in enumerate(hosts):
+            if not host.name:
+                continue
+            keys = [("name", host.name)]
+            if addr and addr.addr:
+                keys.append(("addr", addr.addr))
+            if addr and addr.macaddr:
+                keys.append(("mac", addr.macaddr))
+            lines = set()
+            for key in keys:
+                lines.update(self.check.get(key, []))
+            for fileidx, linenum, filename in lines:
+                res.append((fileidx, linenum, idx, host, filename))
+
+        # keep the order of the records in the checkfiles
+        res.sort(key=lambda dup: dup[:3])
+        return [(host, filename, linenum)
+            for _, linenum, _, host, filename in res]
+
+    def _index_checkfiles(self):
+        """Build an index of the lines declaring each name, address or MAC
+        address in the checkfiles. Files which did not change since their last
+        parsing are read from the checkfile cache."""
+        self.check = {}
+        cache = CheckfileCache()
+        for fileidx, filename in enumerate(self.checkfile.split(", ")):
+            records = cache.get(self.conftype, filename)
+            if records is None:
+                records = self._parse_checkfile(filename)
+                cache.set(self.conftype, filename, records)
+            for kind, value, linenum in records:
+                self.check.setdefault((kind, value), []).append(
+                    (fileidx, linenum, filename))
+
+    def _parse_checkfile(self, filename):
+        """Return the list of (kind, value, line number) records of a
+        checkfile."""
+        file_ = open(filename, "r")
+        content = self._strip_slam_section(file_.read())
+        file_.close()
+        res = []
+        linenum = 1
+        for line in content.split("\n"):
+            if self.comment in line:
+                line = line[:line.find(self.comment)]
+            if line:
+                for kind, value in set(self._checkfile_records(line)):
+                    res.append((kind, value, linenum))
+            linenum += 1
         return res
 
-    def _unique_host(self, line, host, addrs):
-        """Check that a given host does not already exists in the given
-        line."""
+    def _checkfile_records(self, line):
+        """Return the records declared by a line of a checkfile as a list of
+        ("name", name), ("addr", address) or ("mac", mac address) tuples."""
         # implemented in child classes
-        pass
+        return []
 
-    def backup(self):
-        """Backup the existing configuration file to filename.timestamp."""
+    def output_exists(self):
+        """Return true if the output file was already written."""
+        return bool(self.outputfile) and os.path.exists(self.outputfile)
+
+    def backup(self, link=True):
+        """Backup the existing configuration file to filename.timestamp. With
+        *link*, the backup is a hard link to the file, which must then be
+        replaced rather than modified in place, otherwise it is a copy."""
         if (self.outputfile and self.outputfile != "-"
                 and os.access(self.outputfile, os.R_OK)
                 and os.stat(self.outputfile).st_size > 0):
@@ -166,15 +338,23 @@ class Config(SLAMBaseModel):
                 backup = (os.path.dirname(self.outputfile) + "/backup/"
                     + os.path.basename(self.outputfile) + "-"
                     + datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
-                shutil.copyfile(self.outputfile, backup)
             else:
-                shutil.copyfile(self.outputfile, self.outputfile + "-"
+                backup = (self.outputfile + "-"
                     + datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+            if link:
+                try:
+                    # a link to a symbolic link would follow the new file
+                    os.link(os.path.realpath(self.outputfile), backup)
+                    return
+                except OSError:
+                    # existing backup or file system without hard links
+                    pass
+            shutil.copyfile(self.outputfile, backup)
 
     def createconf(self, genpools):
         """Create a new configuration file from the header, the content and the
         footer. It returns records found in the checkfile list."""
-        if not "output" in dir(self) or not self.output:
+        if (not "output" in dir(self) or not self.output) and not self.atomic:
             self.load()
 
         # search duplicates and remove them from *hosts*
@@ -190,31 +370,30 @@ class Config(SLAMBaseModel):
                     hosts_tmp.remove(dup_host)
             duplicates.extend(tmp_dup)
 
-        self.output.seek(0)
-        self.output.truncate()
+        output = self.output
+        self.output = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
         if self.header is not None:
-            self.gen_header(list(self.header))
-        self.output.write("\n" + self.comment + " This section will be "
-            + "automatically generated by SLAM any manual change will\n"
-            + self.comment
-            + " be overwritten on the next generation of this file.\n")
+            self.gen_header(self.header)
+        slambegin, slamend = _markers(self.comment)
+        self.output.write("\n" + slambegin)
         for pool, pool_hosts in genpools:
             if pool:
                 self.output.write(self.comment + " Pool " + str(pool) + "\n")
             self.generate(pool_hosts)
-        self.output.write(self.comment
-            + " END of section automatically generated by SLAM\n")
+        self.output.write(slamend)
         if self.footer is not None:
-            self.gen_footer(list(self.footer))
+            self.gen_footer(self.footer)
 
-        self.output.flush()
+        rendered = self.output
+        self.output = output
+        self._write_output(rendered)
         return duplicates
 
     def updateconf(self, genpools):
         """Update an already existing configuration file and replace a
         previously existing content by a new regenerated one. It returns a list
         of duplicates records found in checkfile."""
-        if not "output" in dir(self) or not self.output:
+        if (not "output" in dir(self) or not self.output) and not self.atomic:
             self.load()
 
         # search duplicates and remove them from *hosts*
@@ -230,37 +409,152 @@ class Config(SLAMBaseModel):
                     hosts_tmp.remove(dup_host)
             duplicates.extend(tmp_dup)
 
-        headers = []
-        for line in self.output:
-            headers.append(line)
-            if (len(headers) > 1
-                    and line == self.comment + " be overwritten on the next "
-                        + "generation of this file.\n"
-                    and headers[-2] == self.comment
-                        + " This section will be automatically generated by "
-                        + "SLAM any manual change will\n"):
-                break
-
-        footers = []
-        for line in self.output:
-            if (footers or line == self.comment
-                    + " END of section automatically generated by SLAM\n"):
-                footers.append(line)
-
-        self.output.seek(0)
-        self.output.truncate()
-        if headers:
-            self.gen_header(headers)
-        for pool, hosts in genpools:
-            if pool:
-                self.output.write(self.comment + " Pool " + str(pool) + "\n")
-            self.generate(hosts)
-        if footers:
-            self.gen_footer(footers)
-
-        self.output.flush()
+        # the header ends with the beginning of the SLAM section and the
+        # footer starts with its end, without any section all the file is
+        # kept as the header
+        buf = self._map_output()
+        try:
+            size = len(buf)
+            begin, end = _slam_section(buf, self.comment)
+            if begin < 0:
+                begin, end = size, size
+            else:
+                begin += len(_markers(self.comment)[0])
+                if end < 0:
+                    end = size
+
+            output = self.output
+            self.output = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+            self.gen_header(_lines(buf, 0, begin))
+            for pool, hosts in genpools:
+                if pool:
+                    self.output.write(self.comment + " Pool " + str(pool)
+                        + "\n")
+                self.generate(hosts)
+            self.gen_footer(_lines(buf, end, size))
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+        rendered = self.output
+        self.output = output
+        self._write_output(rendered)
         return duplicates
 
+    def _map_output(self):
+        """Return the current content of the output as a read-only memory map
+        if it is a regular file or else as a string."""
+        current = self._current_output()
+        if current is None:
+            return ""
+        try:
+            if os.fstat(current.fileno()).st_size > 0:
+                return mmap.mmap(current.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, EnvironmentError, ValueError):
+            # not a regular file
+            pass
+        return current.read()
+
+    def _current_output(self):
+        """Return the output rewound to be read back line by line, or None if
+        it cannot be read back such as the standard output."""
+        if self.output is None:
+            return None
+        try:
+            self.output.seek(0)
+            self.output.read(0)
+            return self.output
+        except IOError:
+            return None
+
+    def _mask(self, line):
+        """Return the *line* without the values updated on every generation
+        to compare two versions of the output."""
+        return line
+
+    def _write_output(self, rendered):
+        """Replace the current content of the output by the *rendered* file.
+        The output and its backup are left untouched if the content did not
+        change, which is reported by the *unchanged* attribute."""
+        rendered.seek(0)
+        current = self._current_output()
+        self.unchanged = current is not None and all(
+            old is not None and new is not None
+                and self._mask(old) == self._mask(new)
+            for old, new in itertools.izip_longest(current, rendered))
+        if self.unchanged:
+            pass
+        elif self.atomic:
+            self._replace_output(rendered)
+        else:
+            rendered.seek(0)
+            if current is not None:
+                self.output.seek(0)
+                self.output.truncate()
+            shutil.copyfileobj(rendered, self.output, COPY_BUFSIZE)
+            self.output.flush()
+        rendered.close()
+
+    def _replace_output(self, rendered):
+        """Write the *rendered* file to a temporary file next to the output
+        file, synchronize it to disk and rename it over the output file, so
+        that readers see either the old or the new file complete. A symbolic
+        link is followed to the file it points to. The output file is written
+        in place if its directory is not writable or if the new file cannot
+        get its owner and group."""
+        outputfile = os.path.realpath(self.outputfile)
+        dirname = os.path.dirname(outputfile)
+        exists = os.access(outputfile, os.F_OK)
+        if exists and not os.access(dirname, os.W_OK):
+            self._overwrite_output(rendered, outputfile)
+            return
+        handle, path = tempfile.mkstemp(dir=dirname,
+            prefix="." + os.path.basename(outputfile) + ".")
+        try:
+            with os.fdopen(handle, "w") as tmp:
+                rendered.seek(0)
+                shutil.copyfileobj(rendered, tmp, COPY_BUFSIZE)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            if exists:
+                shutil.copymode(outputfile, path)
+                stat = os.stat(outputfile)
+                try:
+                    os.chown(path, stat.st_uid, stat.st_gid)
+                except OSError:
+                    os.unlink(path)
+                    self._overwrite_output(rendered, outputfile)
+                    return
+                self.backup()
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(path, 0666 & ~umask)
+            os.rename(path, outputfile)
+        except:
+            if os.access(path, os.F_OK):
+                os.unlink(path)
+            raise
+        _fsync_dir(dirname)
+
+        if self.output is not None:
+            self.output.close()
+        self.output = open(outputfile, "r")
+
+    def _overwrite_output(self, rendered, outputfile):
+        """Overwrite the existing *outputfile* with the *rendered* file, when it
+        cannot be replaced by a new file. The backup is then a copy."""
+        self.backup(link=False)
+        with open(outputfile, "w") as out:
+            rendered.seek(0)
+            shutil.copyfileobj(rendered, out, COPY_BUFSIZE)
+            out.flush()
+            os.fsync(out.fileno())
+
+        if self.output is not None:
+            self.output.close()
+        self.output = open(outputfile, "r")
+
     def __unicode__(self):
         res = (self.name + " (" + self.conftype + "), output file: \""
             + self.outputfile + "\"")
@@ -269,6 +563,88 @@ class Config(SLAMBaseModel):
         return res
 
 
+# lines beginning and ending the SLAM section by comment character
+_MARKERS = {}
+
+
+def _markers(comment):
+    """Return the lines beginning and ending the SLAM section of a file using
+    the *comment* character."""
+    if comment not in _MARKERS:
+        _MARKERS[comment] = (comment + " This section will be automatically "
+            + "generated by SLAM any manual change will\n" + comment
+            + " be overwritten on the next generation of this file.\n",
+            comment + " END of section automatically generated by SLAM\n")
+    return _MARKERS[comment]
+
+
+def _find_line(buf, line, start=0):
+    """Return the offset of the first occurrence of *line* at the beginning of
+    a line of *buf* after *start*, or -1 if there is none."""
+    idx = buf.find(line, start)
+    while idx > 0 and buf[idx - 1] != "\n":
+        idx = buf.find(line, idx + 1)
+    return idx
+
+
+def _slam_section(buf, comment):
+    """Return the offsets of the beginning and of the end markers of the SLAM
+    section in *buf*, a string or a memory map, or -1 if they are missing."""
+    slambegin, slamend = _markers(comment)
+    begin = _find_line(buf, slambegin)
+    if begin < 0:
+        return -1, -1
+    return begin, _find_line(buf, slamend, begin + len(slambegin))
+
+
+def _lines(buf, start, stop):
+    """Iterate over the lines of *buf* between the offsets *start* and
+    *stop*."""
+    while start < stop:
+        end = buf.find("\n", start, stop)
+        if end < 0:
+            end = stop
+        else:
+            end += 1
+        yield buf[start:end]
+        start = end
+
+
+def _fsync_dir(dirname):
+    """Synchronize the entries of the directory *dirname* to disk."""
+    try:
+        handle = os.open(dirname, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(handle)
+    except OSError:
+        pass
+    finally:
+        os.close(handle)
+
+
+def _copy(src, dst):
+    """Copy the file object or the lines *src* to the file object *dst*."""
+    if hasattr(src, "read"):
+        shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+    else:
+        dst.writelines(src)
+
+
+def _names(name):
+    """Return the records matching a host *name*: the name itself and its
+    short name if it is a fully qualified name."""
+    res = [("name", name)]
+    if "." in name:
+        res.append(("name", name[:name.find(".")]))
+    return res
+
+
+# serial number of a SOA record: the third value after SOA
+SOA_SERIAL = re.compile(r"^(.*\bSOA(\s+\S+){2}\s+)[0-9]+", re.MULTILINE)
+
+
 def _update_soa(soa):
     """Increment a SOA record, respecting RFC1912."""
     soa = soa.strip()
@@ -293,12 +669,51 @@ def _update_soa(soa):
     return soa[:idx] + " " + " ".join(values) + "\n"
 
 
+# labels of the octets of an IPv4 address in a reverse name
+_OCTETS = [str(octet) + "." for octet in range(256)]
+
+
+def _reverse_ip4(addr):
+    """Return the reverse name of the IPv4 address *addr* given as an
+    integer."""
+    return (_OCTETS[addr & 0xff] + _OCTETS[(addr >> 8) & 0xff]
+        + _OCTETS[(addr >> 16) & 0xff] + _OCTETS[addr >> 24] + "in-addr.arpa.")
+
+
+def _reverse_ip6(addr):
+    """Return the reverse name of the IPv6 address *addr* given as an
+    integer."""
+    # one label per nibble, from the least significant one
+    return ".".join("%032x" % addr)[::-1] + ".ip6.arpa."
+
+
+def _reverse_name(addr):
+    """Return the reverse name of the Address *addr*, or None if it is not an
+    IP address."""
+    if addr.pool.addr_range_type == "ip4":
+        return _reverse_ip4(addrrange._parse_ip4(str(addr)))
+    elif addr.pool.addr_range_type == "ip6":
+        return _reverse_ip6(addrrange._parse_ip6(str(addr)))
+    return None
+
+
+def _reverse_zone(name):
+    """Return the reverse zone of the reverse name *name*: the /24 of IPv4
+    addresses and the REVBIND_IP6_ZONE_PREFIX nibbles of IPv6 addresses."""
+    if name.endswith(".ip6.arpa."):
+        prefix = getattr(settings, "REVBIND_IP6_ZONE_PREFIX", 64)
+        return name[(32 - prefix // 4) * 2:-1]
+    return name[name.find(".") + 1:-1]
+
+
+@register
 class BindConfig(Config):
     """Represents the configuration of the DNS server Bind that can generate
     parametered configuration lines for hosts."""
 
     comment = ";"
     type_ = "bind"
+    format_ = "bind"
 
     class Meta(SLAMBaseModel.Meta):
         """BindConfig is a proxy of Config."""
@@ -319,49 +734,51 @@ class BindConfig(Config):
         config.timeout = timeout
         return config
 
-    def _unique_host(self, line, host, addr):
-        """Check if the record for a host already exists in the checkfiles."""
+    def _checkfile_records(self, line):
+        """Return the name and address of a Bind record."""
         records = line.split()
-        name = records[0]
-        return not (host.name == name
-            or ("." in name and host.name == name[:name.find(".")])
-            or (addr and addr.addr and addr.addr == records[-1]))
+        if not records:
+            return []
+        return _names(records[0]) + [("addr", records[-1])]
+
+    def _mask(self, line):
+        """Ignore the serial number of the SOA record."""
+        return SOA_SERIAL.sub(r"\1", line)
 
     def gen_header(self, header):
         """Copy the orignial header and update the SOA field."""
-        for line in header:
-            if "SOA" in line:
-                line = _update_soa(line)
-            self.output.write(line)
+        self.output.writelines(_update_soa(line) if "SOA" in line else line
+            for line in header)
 
-    def generate(self, hosts):
+    def records(self, hosts):
         """Generate one configuration record per address for every host given
         in the Bind format line."""
+        timeout = "\t" + str(self.timeout) + "\tIN\t"
         for host, addr, _, _ in hosts:
             if host.nodns:
                 continue
-            self.output.write(host.name + "\t" + str(self.timeout)
-                + "\tIN\t" + addr.pool.dns_record + "\t"
+            yield (host.name + timeout + addr.pool.dns_record + "\t"
                 + str(addr) + "\n")
 
 
+@register
 class RevBindConfig(Config):
     """Represent a generator for reverse DNS zone for the bind zone format."""
 
     comment = ";"
     type_ = "rbind"
+    format_ = "revbind"
 
     class Meta(SLAMBaseModel.Meta):
         """RevBindConfig is a proxy of Config."""
         proxy = True
 
-    def _unique_host(self, line, host, addr):
-        """Check if the record for a host already exists in the checkfiles."""
+    def _checkfile_records(self, line):
+        """Return the name and reverse address of a PTR record."""
         records = line.split()
-        name = records[-1]
-        return not (host.name == name
-            or ("." in name and host.name == name[:name.find(".")])
-            or (addr and addr.addr and addr.addr == records[0]))
+        if not records:
+            return []
+        return _names(records[-1]) + [("addr", records[0])]
 
     @classmethod
     def create(cls, name="", default=False, domain="", outputfile=None,
@@ -378,81 +795,138 @@ class RevBindConfig(Config):
         config.timeout = timeout
         return config
 
-    def generate(self, hosts):
+    def createconf(self, genpools):
+        """Create the configuration file, or one per reverse zone if the name
+        of the output file contains {zone}."""
+        if "{zone}" in (self.outputfile or ""):
+            return self._split_zones(Config.createconf, genpools)
+        return Config.createconf(self, genpools)
+
+    def updateconf(self, genpools):
+        """Update the configuration file, or one per reverse zone if the name
+        of the output file contains {zone}."""
+        if "{zone}" in (self.outputfile or ""):
+            return self._split_zones(Config.updateconf, genpools)
+        return Config.updateconf(self, genpools)
+
+    def _written_zones(self):
+        """Return the reverse zones whose file was already written, their
+        backups and temporary files do not end with the name of the zone."""
+        pattern = re.compile(re.escape(self.outputfile).replace(
+            re.escape("{zone}"), r"(.+\.(?:in-addr|ip6)\.arpa)") + "$")
+        res = []
+        for path in glob.glob(self.outputfile.replace("{zone}", "*")):
+            match = pattern.match(path)
+            if match:
+                res.append(match.group(1))
+        return res
+
+    def output_exists(self):
+        """Return true if the output file, or one of the zone files, was
+        already written."""
+        if "{zone}" in (self.outputfile or ""):
+            return bool(self._written_zones())
+        return Config.output_exists(self)
+
+    def _split_zones(self, method, genpools):
+        """Run *method* on a copy of the generator for each reverse zone of
+        the addresses of *genpools*, writing to the output file whose {zone}
+        is replaced by the name of the zone. The files of the zones left
+        without any address are rendered again without records."""
+        zones = dict((zone, []) for zone in self._written_zones())
+        for pool, hosts in genpools:
+            for hostaddr in hosts:
+                name = _reverse_name(hostaddr[1])
+                if name is None:
+                    continue
+                zonepools = zones.setdefault(_reverse_zone(name), [])
+                if not zonepools or zonepools[-1][0] is not pool:
+                    zonepools.append((pool, []))
+                zonepools[-1][1].append(hostaddr)
+
+        duplicates = []
+        self.unchanged = True
+        for zone in sorted(zones):
+            gen = copy.copy(self)
+            gen.outputfile = self.outputfile.replace("{zone}", zone)
+            gen.load()
+            gen.check = getattr(self, "check", None)
+            try:
+                duplicates.extend(method(gen, zones[zone]))
+            finally:
+                if gen.output is not None:
+                    gen.output.close()
+            self.check = gen.check
+            self.unchanged = self.unchanged and gen.unchanged
+        return duplicates
+
+    def records(self, hosts):
         """Generate a reverse mapping for Addresses"""
+        timeout = "\t" + str(self.timeout) + "\tIN\tPTR\t"
         for host, addr, _, _ in hosts:
             if host.nodns:
                 continue
-            if addr.pool.addr_range_type == "ip4":
-                split = str(addr).split(".")
-                rev = "in-addr.arpa."
-                for atom in split:
-                    rev = atom + "." + rev
-            elif addr.pool.addr_range_type == "ip6":
-                addr = str(addr).replace(":", "")
-                rev = "ip6.arpa."
-                for digit in addr:
-                    rev = digit + "." + rev
-            else:
+            rev = _reverse_name(addr)
+            if rev is None:
                 continue
-            self.output.write(rev + "\t" + str(self.timeout)
-                + "\tIN\tPTR\t" + host.name + "\n")
+            yield rev + timeout + host.name + "\n"
 
 
+@register
 class QuattorConfig(Config):
     """Class used to generate the Quattor configuration file for a host."""
 
     type_ = "quatt"
+    format_ = "quattor"
 
     class Meta(SLAMBaseModel.Meta):
         """QuattorConfig is a proxy of Config."""
         proxy = True
 
-    def _unique_host(self, line, host, addr):
-        """Check if the record for a host already exists in the checkfiles."""
-        name = line.split("\"")[1]
+    def _checkfile_records(self, line):
+        """Return the name and the addresses quoted in a Quattor record."""
+        quoted = line.split("\"")[1::2]
+        if not quoted:
+            return []
+        return _names(quoted[0]) + [("addr", addr) for addr in quoted]
 
-        return not (host.name == name
-            or ("." in name[1] and host.name == name[:name.find(".")])
-            or (addr and addr.addr and addr.addr in line))
-
-    def generate(self, hosts):
+    def records(self, hosts):
         """Generate a configuration for every hosts for a Quattor configuration
         file."""
         for host, addr, _, _ in hosts:
-            self.output.write('escape("' + host.name + '"),"'
-                + str(addr) + '",\n')
+            yield 'escape("' + host.name + '"),"' + str(addr) + '",\n'
 
 
+@register
 class DhcpdConfig(Config):
     """Generate a host line usable by isc-DHCPd."""
 
     type_ = "dhcp"
+    format_ = "dhcp"
 
     class Meta(SLAMBaseModel.Meta):
         """DhcpdConfig is a proxy of Config."""
         proxy = True
 
-    def _unique_host(self, line, host, addr):
-        """Check if the record for a host already exists in the checkfiles."""
-        records = line.split()
-        if (addr and addr.macaddr and (addr.macaddr in records
-                or addr.macaddr + ";" in records)):
-            return False
-
-        if "host" not in line or len(line.split()) <= 1:
-            return True
-
-        name = line[line.find("host"):].split()[1]
-        return "host" not in line or not (host.name == name
-            or ("." in name and host.name == name[:name.find(".")]))
+    def _checkfile_records(self, line):
+        """Return the MAC addresses and the host name of a DHCP record."""
+        res = []
+        for record in line.split():
+            res.append(("mac", record))
+            if record.endswith(";"):
+                res.append(("mac", record[:-1]))
+        if "host" in line:
+            records = line[line.find("host"):].split()
+            if len(records) > 1:
+                res.extend(_names(records[1]))
+        return res
 
-    def generate(self, hosts):
+    def records(self, hosts):
         """Generate a configuration file of the static address configuration
         of hosts for isc-DHCP."""
 
         if self.domain:
-            self.output.write("option domain-name \"" + self.domain + "\";\n")
+            yield "option domain-name \"" + self.domain + "\";\n"
 
         for host, addr, aliases, _ in hosts:
             if addr.macaddr:
@@ -467,26 +941,27 @@ class DhcpdConfig(Config):
                 line = "host " + hostname + " { "
                 line += "hardware ethernet " + addr.macaddr + "; "
                 line += "fixed-address " + str(hostname) + "; }\n"
-                self.output.write(line)
+                yield line
 
 
+@register
 class LalDnsConfig(Config):
     """Generator for the configuration format of the LAL custom DNS format."""
 
     type_ = "laldns"
+    format_ = "laldns"
 
     class Meta(SLAMBaseModel.Meta):
         """LalDns is a proxy of Config."""
         proxy = True
 
-    def _unique_host(self, line, host, addr):
-        """Check that the current record does not already exist in
-        checkfiles."""
+    def _checkfile_records(self, line):
+        """Return the names and the address of a record."""
         records = line.split()
-        return not (host.name in records[1:]
-            or (addr and addr.addr and addr.addr in records))
+        return ([("name", name) for name in records[1:]]
+            + [("addr", addr) for addr in records])
 
-    def generate(self, hosts):
+    def records(self, hosts):
         """Generate configuration for the specific format of DNS configuration
         file used by the LAL."""
         for host, addr, aliases, mx_record in hosts:
@@ -495,5 +970,5 @@ class LalDnsConfig(Config):
             alias = ""
             for aliasobj in aliases:
                 alias += "\t" + aliasobj.name
-            self.output.write(str(addr) + "\t" + host.name
-                + alias + "\t" + mx_record + "\n")
+            yield (str(addr) + "\t" + host.name + alias + "\t" + mx_record
+                + "\n")
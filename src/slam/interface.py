@@ -1,8 +1,12 @@
 """Helper to execute actions on the database independantly from the interface
 and output format."""
 
-import logging, datetime, sys, re
-from slam import generator, models
+import logging, datetime, sys, re, os, json
+import multiprocessing
+from django.conf import settings
+from django.db import connections, transaction, IntegrityError
+from django.db.models import Count, Max, Min, Q
+from slam import generator, models, addrrange, poolindex
 from slam.log import DbLogHandler
 
 
@@ -81,14 +85,72 @@ def get_pool(pool_name=None, category=None):
                 + str(pool_name))
         return models.Pool.objects.get(name=pool_name)
     elif category:
-        for poolobj in models.Pool.objects.exclude(category=""):
-            if category in poolobj.category.split(","):
-                return poolobj
-        raise InexistantObjectError("No pool in category: " + category)
+        pools = category_pools(category)
+        if not pools:
+            raise InexistantObjectError("No pool in category: " + category)
+        return pools[0]
     else:
         return None
 
 
+def _category_key(used, size):
+    """Return the sort key of a pool with *used* addresses out of *size* in
+    the pools of a category, following the POOL_CATEGORY_STRATEGY."""
+    if used >= size:
+        return (1, 0)
+    usage = used / float(size)
+    if getattr(settings, "POOL_CATEGORY_STRATEGY", "fill-first"
+            ) == "least-full":
+        return (0, usage)
+    return (0, -usage)
+
+
+def category_pools(category):
+    """Return the pools of *category* in the order in which addresses are
+    allocated from them: the most used pools first with the "fill-first"
+    POOL_CATEGORY_STRATEGY, or the least used pools first with "least-full".
+    Full pools always come last."""
+    pools = list(models.Pool.objects.filter(categories__name=category
+        ).order_by("id"))
+    pools.sort(key=lambda poolobj: _category_key(poolobj.used(),
+        poolobj.len()))
+    return pools
+
+
+def pool_stats(pools=None):
+    """Return a (pool, used, total, percentage) tuple for every pool of the
+    *pools* queryset, or of all the pools sorted by name. The addresses of all
+    the pools are counted with a single query."""
+    if pools is None:
+        pools = models.Pool.objects.all().order_by("name")
+    res = []
+    for poolobj in pools.annotate(addr_used=Count("address")):
+        total = poolobj.len()
+        try:
+            perc = poolobj.addr_used * 100 / total
+        except ZeroDivisionError:
+            perc = 100
+        res.append((poolobj, poolobj.addr_used, total, perc))
+    return res
+
+
+def check_alloc_maps(pool_names=None):
+    """Check the allocation map of the given pools, or of every pool, against
+    their allocated addresses and rebuild the inconsistent ones. It returns the
+    list of the pools whose map had to be rebuilt."""
+    if pool_names:
+        pools = [get_pool(pool_name) for pool_name in pool_names]
+    else:
+        pools = models.Pool.objects.all()
+
+    res = []
+    for pool in pools:
+        if not pool.rebuild_alloc_map():
+            LOGGER.info("Rebuilt the allocation map of pool " + pool.name)
+            res.append(pool)
+    return res
+
+
 def create_pool(pool_name=None, definition=None, category=None):
     """Try to retrieve the given *pool_name* from the database or a create a
     new one with the given *definition* otherwise."""
@@ -105,6 +167,11 @@ def create_pool(pool_name=None, definition=None, category=None):
         category = ",".join(category)
     pool = models.Pool.create(name=pool_name, definition=definition,
         category=category)
+    overlapping = poolindex.get_index().overlapping(pool.addr_range)
+    if overlapping:
+        LOGGER.warning("Pool " + pool_name + " overlaps the pools: "
+            + ", ".join(models.Pool.objects.filter(pk__in=overlapping
+                ).order_by("name").values_list("name", flat=True)))
     LOGGER.info("Created pool: " + str(pool))
     pool.save()
 
@@ -127,29 +194,11 @@ def create_generator(name, type_, outputfile, default=False, header=None,
         raise MissingParameterError(
             "You must provide an output file for the new generator.")
 
-    genobj = None
-    if type_ == "bind":
-        genobj = generator.BindConfig.create(name=name, default=default,
-            outputfile=outputfile, header=header, footer=footer,
-            checkfile=checkfile, update=True, timeout=timeout)
-    elif type_ == "revbind":
-        genobj = generator.RevBindConfig.create(name=name, default=default,
-            outputfile=outputfile, header=header, footer=footer,
-            checkfile=checkfile, update=True, timeout=timeout)
-    elif type_ == "dhcp":
-        genobj = generator.DhcpdConfig.create(name=name, default=default,
-            outputfile=outputfile, header=header, footer=footer,
-            checkfile=checkfile, update=True)
-    elif type_ == "quattor":
-        genobj = generator.QuattorConfig.create(name=name, default=default,
-            outputfile=outputfile, header=header, checkfile=checkfile,
-            footer=footer, update=True)
-    elif type_ == "laldns":
-        genobj = generator.LalDnsConfig.create(name=name, default=default,
-            outputfile=outputfile, header=header, checkfile=checkfile,
-            footer=footer, update=True)
-    else:
+    if type_ not in generator.FORMATS:
         raise MissingParameterError("Wrong configuration format: " + type_)
+    genobj = generator.FORMATS[type_].create(name=name, default=default,
+        outputfile=outputfile, header=header, footer=footer,
+        checkfile=checkfile, update=True, timeout=timeout)
     genobj.save()
 
     LOGGER.info("Created new generator: " + str(genobj))
@@ -167,22 +216,8 @@ def get_generator(name):
     genobj = None
 
     if name:
-        if not models.Config.objects.filter(name=name):
-            raise InexistantObjectError("Could not find generator: "
-                + name)
-
-        confobj = models.Config.objects.get(name=name)
-        if confobj.conftype == "bind":
-            genobj = generator.BindConfig.objects.get(name=name)
-        elif confobj.conftype == "rbind":
-            genobj = generator.RevBindConfig.objects.get(name=name)
-        elif confobj.conftype == "dhcp":
-            genobj = generator.DhcpdConfig.objects.get(name=name)
-        elif confobj.conftype == "quatt":
-            genobj = generator.QuattorConfig.objects.get(name=name)
-        elif confobj.conftype == "laldns":
-            genobj = generator.LalDnsConfig.objects.get(name=name)
-        else:
+        genobj = models.Config.objects.filter(name=name).first()
+        if genobj is None or generator.cast(genobj) is None:
             raise InexistantObjectError("Could not find generator: "
                 + name)
 
@@ -198,9 +233,8 @@ def get_default_generators(conf_type=None):
 
     res = []
     for gen in gens:
-        tmp = get_generator(gen.name)
-        if tmp:
-            res.append(tmp)
+        if generator.cast(gen):
+            res.append(gen)
 
     return res
 
@@ -248,15 +282,112 @@ def modify_generator(name, default=False, outputfile=None, header=None,
         logmsg = logmsg[1:]
 
     LOGGER.info("Modified generator " + str(name) + logmsg)
+    # the next update regenerates the whole file with the new settings
+    gen.revision = None
+    gen.checkfile_stamps = None
     gen.save()
 
 
+def _load_snapshot(pools):
+    """Load the hosts of the given pools once for all the generators. It
+    returns a dictionary of tuples of (host, address, aliases, mx record) by
+    pool id, built with a constant number of queries."""
+    mx_records = dict(models.Property.objects.filter(name="mx",
+        host__isnull=False).values_list("host_id", "value"))
+    hosts = dict((pool.pk, []) for pool in pools)
+    for addr in models.Address.objects.filter(pool__in=pools,
+            host__isnull=False).select_related("host", "pool").prefetch_related(
+            "host__alias_set").order_by("pk"):
+        hosts[addr.pool_id].append((addr.host, addr,
+            tuple(addr.host.alias_set.all()), mx_records.get(addr.host_id, "")))
+    return dict((pool_id, tuple(poolhosts))
+        for pool_id, poolhosts in hosts.items())
+
+
+def _checkfile_stamps(gen):
+    """Return the modification time and size of the check files of *gen*
+    serialized in a string, or None if one of them cannot be read."""
+    stamps = []
+    try:
+        for checkfile in (gen.checkfile or "").split(", "):
+            if checkfile:
+                stat = os.stat(checkfile)
+                stamps.append([checkfile, stat.st_mtime, stat.st_size])
+    except OSError:
+        return None
+    return json.dumps(stamps)
+
+
+def _is_uptodate(gen, pools):
+    """Return true if the output file of the saved generator *gen* already
+    contains the last revision of the hosts of *pools* and if its check files
+    did not change since."""
+    if (gen.pk is None or gen.revision is None or not gen.outputfile
+            or gen.outputfile == "-" or not gen.output_exists()):
+        return False
+    stamps = _checkfile_stamps(gen)
+    if stamps is None or stamps != gen.checkfile_stamps:
+        return False
+    return not models.ChangeEntry.objects.filter(id__gt=gen.revision).filter(
+        Q(pool_id__in=[pool.pk for pool in pools]) | Q(pool_id__isnull=True)
+        ).exists()
+
+
+# generator tasks inherited by the worker processes of _run_generator_jobs
+_GENERATOR_JOBS = []
+
+
+def _run_generator_job(idx):
+    """Run the generator task number *idx*, which replaces its output file
+    once complete unless the content did not change. It returns the duplicate
+    records found by the generator and whether the content was unchanged."""
+    gen, genpools, update = _GENERATOR_JOBS[idx]
+    if update:
+        res = gen.updateconf(genpools)
+    else:
+        res = gen.createconf(genpools)
+    if gen.output is not None:
+        gen.output.close()
+    return res, gen.unchanged
+
+
+def _run_generator_jobs(tasks, jobs):
+    """Run the (generator, pools, update) *tasks* in a pool of *jobs* worker
+    processes and return their duplicate records, in the order of the
+    tasks."""
+    _GENERATOR_JOBS[:] = tasks
+    # the workers do not use the database, do not share the connections
+    connections.close_all()
+    workers = multiprocessing.Pool(min(jobs, len(tasks)))
+    try:
+        res = workers.map(_run_generator_job, range(len(tasks)))
+        workers.close()
+    except:
+        workers.terminate()
+        raise
+    finally:
+        workers.join()
+        _GENERATOR_JOBS[:] = []
+    for (gen, _, _), (_, unchanged) in zip(tasks, res):
+        if gen.output is not None:
+            gen.output.close()
+        gen.output = None
+        gen.unchanged = unchanged
+    return [dup for dup, _ in res]
+
+
 def generate(gen_name=None, pool_name=None, conf_format=None,
         output=None, header=None, footer=None, checkfile=None, timeout=None,
-        domain=None, update=True):
+        domain=None, update=True, jobs=1):
     """Generate a specified configuration file for the addresses in the given
     pool. It returns a list of duplicate records found in the checkfile of the
-    generator."""
+    generator. With more than one *jobs*, the generators writing to a file are
+    run concurrently in as many processes, unless a transaction is in progress
+    as the connections are closed before starting them."""
+    if jobs > 1 and any(conn.in_atomic_block for conn in connections.all()):
+        LOGGER.info("Generate the configuration files one at a time within "
+            "the current transaction")
+        jobs = 1
     pools = []
     if pool_name:
         for pool in pool_name:
@@ -269,72 +400,90 @@ def generate(gen_name=None, pool_name=None, conf_format=None,
     elif not conf_format and not output:
         gens = get_default_generators(conf_format)
     else:
-        if conf_format == "bind":
-            gen = generator.BindConfig.create(outputfile=output, header=header,
-                footer=footer, checkfile=checkfile, timeout=timeout,
-                update=update, domain=domain)
-        elif conf_format == "revbind":
-            gen = generator.RevBindConfig.create(outputfile=output,
-                header=header, footer=footer, checkfile=checkfile,
-                timeout=timeout, update=update, domain=domain)
-        elif conf_format == "dhcp":
-            gen = generator.DhcpdConfig.create(outputfile=output,
-                header=header, footer=footer, checkfile=checkfile,
-                update=update, domain=domain)
-        elif conf_format == "quattor":
-            gen = generator.QuattorConfig.create(outputfile=output,
-                header=header, footer=footer, checkfile=checkfile,
-                update=update, domain=domain)
-        elif conf_format == "laldns":
-            gen = generator.LalDnsConfig.create(outputfile=output,
-                header=header, footer=footer, checkfile=checkfile,
-                update=update, domain=domain)
-        else:
+        if conf_format not in generator.FORMATS:
             raise ConfigurationFormatError(
                 "Unknown configuration format: " + str(conf_format))
+        gen = generator.FORMATS[conf_format].create(outputfile=output,
+            header=header, footer=footer, checkfile=checkfile,
+            timeout=timeout, update=update, domain=domain)
 
     # Individual generators are treated as a list of one generator
     if (not gens) and gen:
         gens = [gen]
 
-    duplicates = []
+    revision = models.ChangeEntry.objects.aggregate(Max("id"))["id__max"] or 0
+    gens_pools = []
+    stamps = {}
+    restricted = set()
     for gen in gens:
-        if "output" not in gen.__dict__ or not gen.output:
-            gen.load()
-
         relatedpools = models.Pool.objects.filter(generator__name=gen.name,
                 generator__conftype=gen.conftype)
         if relatedpools:
             pools = list(relatedpools)
+        elif pool_name:
+            # the other pools are not rendered, the next full update must not
+            # be skipped
+            restricted.add(gen.pk)
 
-        genpools = []
         if not pools:
-            pools = models.Pool.objects.all()
-        for pool in pools:
-            hosts = []
-            for addr in models.Address.objects.filter(pool=pool):
-                if addr.host:
-                    mx_record = ""
-                    if models.Property.objects.filter(
-                            name="mx", host=addr.host):
-                        mx_record = models.Property.objects.get(
-                            name="mx", host=addr.host).value
-                    hosts.append((addr.host,
-                        addr, addr.host.alias_set.all(), mx_record))
-            genpools.append((pool, hosts))
-
-        gen.backup()
+            pools = list(models.Pool.objects.all())
+        if update and _is_uptodate(gen, pools):
+            LOGGER.info("Configuration of generator " + str(gen)
+                + " is up to date")
+            continue
+
+        if "output" not in gen.__dict__ or not gen.output:
+            gen.load()
+        gens_pools.append((gen, pools))
+        # stamped before rendering, a check file edited meanwhile renders again
+        stamps[gen.pk] = _checkfile_stamps(gen)
+
+    # the dataset is shared by all the generators, they only get their own
+    # copy of the lists of hosts because they remove the duplicates from them
+    allpools = dict((pool.pk, pool) for _, pools in gens_pools
+        for pool in pools)
+    snapshot = _load_snapshot(allpools.values())
+
+    results = []
+    tasks = []
+    for gen, pools in gens_pools:
+        genpools = [(pool, list(snapshot[pool.pk])) for pool in pools]
+
         poolmsg = ""
         if pools:
             poolmsg = " for pool " + ", ".join([pool.name for pool in pools])
         if update:
             LOGGER.info("Update configuration with generator " + str(gen)
                 + poolmsg)
-            duplicates.extend(gen.updateconf(genpools))
         else:
             LOGGER.info("Create new configuration with generator " + str(gen)
                 + poolmsg)
-            duplicates.extend(gen.createconf(genpools))
+        if jobs > 1 and gen.outputfile and gen.outputfile != "-":
+            results.append(None)
+            tasks.append((len(results) - 1, (gen, genpools, update)))
+        elif update:
+            results.append(gen.updateconf(genpools))
+        else:
+            results.append(gen.createconf(genpools))
+
+    if tasks:
+        for idx, res in zip([idx for idx, _ in tasks],
+                _run_generator_jobs([task for _, task in tasks], jobs)):
+            results[idx] = res
+    duplicates = []
+    for res in results:
+        duplicates.extend(res)
+    for gen, _ in gens_pools:
+        if gen.unchanged:
+            LOGGER.info("Configuration file " + gen.outputfile
+                + " is unchanged")
+    stamped = [gen for gen, _ in gens_pools
+        if gen.pk is not None and gen.pk not in restricted]
+    for gen in stamped:
+        generator.Config.objects.filter(pk=gen.pk).update(
+            revision=revision, checkfile_stamps=stamps[gen.pk])
+    if stamped:
+        delete_changes()
 
     for dup_host, dup_file, dup_line in duplicates:
         LOGGER.warn("Duplicate record: a record already exists for "
@@ -345,19 +494,23 @@ def generate(gen_name=None, pool_name=None, conf_format=None,
 
 
 def allocate_address(pool, host=None, address=None, random=False,
-    category=None, duration=None):
-    """Allocate a new address from *pool* to *host*."""
+    category=None, duration=None, hint=None, eui64=False, mac=None):
+    """Allocate a new address from *pool* to *host*. The search for an
+    available address starts at *hint* if given. With *eui64*, the address of
+    an IPv6 pool is derived from *mac*, or from the MAC address of *host*."""
+    pools = None
     if not pool:
-        if address:
-            for poolobj in models.Pool.objects.all():
-                poolobj._update()
-                if (poolobj.addr_range is not None
-                        and address in poolobj.addr_range):
-                    pool = poolobj
-                    break
+        if address or hint:
+            pool = poolindex.find_pool(address or hint)
+            if pool is None:
+                raise models.AddressNotInPoolError("Address \""
+                    + (address or hint) + "\" is not in any pool.")
         elif category:
-            print("foo")
-            pool = get_pool(None, category)
+            pools = category_pools(category)
+            if not pools:
+                raise InexistantObjectError("No pool in category: "
+                    + category)
+            pool = pools[0]
         else:
             raise MissingParameterError("Could not find a pool for the given"
                 " pool name, category or address.")
@@ -367,22 +520,39 @@ def allocate_address(pool, host=None, address=None, random=False,
         if address:
             addr = pool.allocate(address, host)
         else:
-            pools = [pool]
-            if category:
-                for poolobj in models.Pool.objects.all():
-                    if (poolobj != pool
-                            and  category in pool.category.split(",")):
-                        pools.append(pool)
+            if pools is None:
+                pools = [pool]
+                if category:
+                    pools += [poolobj for poolobj in category_pools(category)
+                        if poolobj.pk != pool.pk]
+            if eui64:
+                if not mac:
+                    macaddrs = host.address_set.exclude(macaddr=""
+                        ).values_list("macaddr", flat=True)
+                    if not macaddrs:
+                        raise MissingParameterError("A MAC address is needed"
+                            " to allocate an EUI-64 address.")
+                    mac = macaddrs[0]
+                if category:
+                    pools = [poolobj for poolobj in pools
+                        if poolobj.addr_range_type == "ip6"]
             for poolobj in pools:
                 try:
-                    if random:
+                    if eui64:
+                        addr = poolobj.get_eui64(mac)
+                    elif random:
                         addr = poolobj.get_rand()
+                    elif poolobj is pool:
+                        addr = poolobj.get(hint)
                     else:
                         addr = poolobj.get()
                     if addr:
                         break
                 except models.FullPoolError:
                     pass
+                except models.AddressNotAvailableError:
+                    if not category:
+                        raise
 
         if addr:
             LOGGER.info("Assign address " + str(addr) + " to host "
@@ -415,9 +585,10 @@ def allocate_address(pool, host=None, address=None, random=False,
 
 def create_host(host, pool=None, address=None, mac=None, random=False,
     alias=None, category=None, serial="", inventory="", duration=None,
-    nodns=False):
+    nodns=False, hint=None, eui64=False):
     """Create a new host and assign it the first element of addesses or
-    automatically one from the given pool, eventually random."""
+    automatically one from the given pool, eventually random, found from
+    *hint* or derived from *mac* with *eui64*."""
     #validation
     if not host:
         raise MissingParameterError(
@@ -470,8 +641,9 @@ def create_host(host, pool=None, address=None, mac=None, random=False,
             aliasobj = models.Alias(name=alia, host=hostobj)
             aliasobj.save()
 
-    if pool or category or address:
-        addrobj = allocate_address(pool, hostobj, address, random, category)
+    if pool or category or address or hint:
+        addrobj = allocate_address(pool, hostobj, address, random, category,
+            hint=hint, eui64=eui64, mac=mac)
         pool = addrobj.pool
         addrres = str(addrobj)
         if duration:
@@ -497,6 +669,216 @@ def create_host(host, pool=None, address=None, mac=None, random=False,
         return str(hostobj), None
 
 
+def _chunks(seq, size=500):
+    """Split *seq* in lists of at most *size* elements to stay below the
+    limit of parameters of a query."""
+    seq = list(seq)
+    for idx in range(0, len(seq), size):
+        yield seq[idx:idx + size]
+
+
+def _existing_names(model, names):
+    """Return the subset of *names* already used by objects of *model*."""
+    res = set()
+    for chunk in _chunks(names):
+        res.update(model.objects.filter(name__in=chunk).values_list("name",
+            flat=True))
+    return res
+
+
+def _bulk_find_pools(records):
+    """Return the candidate pools of each record: its pool found by name or by
+    address, or the pools of its category in the order of
+    :func:`category_pools`."""
+    names = set([rec["pool"] for rec in records if rec.get("pool")])
+    pools = {}
+    for chunk in _chunks(names):
+        for pool in models.Pool.objects.filter(name__in=chunk):
+            pools[pool.name] = pool
+    for name in names:
+        if name not in pools:
+            raise InexistantObjectError("Could not find pool named: "
+                + str(name))
+
+    index = None
+    categories = {}
+    res = []
+    for rec in records:
+        pool = None
+        if rec.get("pool"):
+            pool = pools[rec["pool"]]
+            if rec.get("address") and rec["address"] not in pool:
+                raise models.AddressNotInPoolError("Address \""
+                    + rec["address"] + "\" is not in pool: " + pool.name)
+        elif rec.get("address") or rec.get("hint"):
+            address = rec.get("address") or rec["hint"]
+            if index is None:
+                index = poolindex.get_index()
+                pools_by_id = dict((pool.pk, pool) for pool in pools.values())
+            pool_id = index.find(address)
+            if pool_id is not None and pool_id not in pools_by_id:
+                poolobj = models.Pool.objects.get(pk=pool_id)
+                pools_by_id[pool_id] = pools.setdefault(poolobj.name, poolobj)
+            pool = pools_by_id.get(pool_id)
+            if pool is None:
+                raise models.AddressNotInPoolError("Address \""
+                    + address + "\" is not in any pool.")
+        elif rec.get("category"):
+            if rec["category"] not in categories:
+                candidates = []
+                for poolobj in category_pools(rec["category"]):
+                    candidates.append(pools.setdefault(poolobj.name, poolobj))
+                if not candidates:
+                    raise InexistantObjectError("No pool in category: "
+                        + rec["category"])
+                categories[rec["category"]] = candidates
+            res.append(categories[rec["category"]])
+            continue
+        res.append([pool] if pool is not None else [])
+    return res
+
+
+def _bulk_eui64(rec, candidates):
+    """Return the first pool of *candidates* in which the EUI-64 address
+    derived from the MAC address of the record *rec* is available, and this
+    address."""
+    if not rec.get("mac"):
+        raise MissingParameterError("A MAC address is needed to allocate an "
+            "EUI-64 address for: " + rec["host"])
+    ip6pools = [pool for pool in candidates if pool.addr_range_type == "ip6"]
+    if not ip6pools:
+        raise models.AddressNotInPoolError("EUI-64 addresses can only be "
+            "allocated in IPv6 pools: " + candidates[0].name)
+    for pool in ip6pools:
+        try:
+            address = pool.addr_range.eui64(rec["mac"])
+        except addrrange.InvalidAddressError as exc:
+            raise models.AddressNotInPoolError(str(exc))
+        if not pool.isallocated(address):
+            return pool, address
+    raise models.AddressNotAvailableError("Address \"" + address
+        + "\" is not available.")
+
+
+def bulk_create_hosts(records):
+    """Create the hosts described by *records* in a single transaction. Each
+    record is a dictionary with the key *host* and optionally *pool*,
+    *address*, *mac*, *alias*, *category*, *serial*, *inventory*, *duration*,
+    *nodns*, *random*, *hint* and *eui64*, with the same meaning as the
+    arguments of :func:`create_host`. Every record is validated before
+    anything is written. It returns the list of the host names and allocated
+    addresses."""
+    records = list(records)
+    names = set()
+    for rec in records:
+        host = rec.get("host")
+        if not host:
+            raise MissingParameterError(
+                "You must provide a name for the new host.")
+        if not isValidHostname(hostname=host):
+            raise PropertyFormatError("You must provide a valid name (without "
+                "space, special character) for the new host: " + str(host))
+        for alia in rec.get("alias") or []:
+            if not isValidHostname(hostname=alia):
+                raise PropertyFormatError("You must provide a valid alias name"
+                    " (without space, special character): " + str(alia))
+        for name in [host] + list(rec.get("alias") or []):
+            if name in names:
+                raise DuplicateObjectError("The name [" + str(name)
+                    + "] is given several times.")
+            names.add(name)
+
+    existing = (_existing_names(models.Host, names)
+        | _existing_names(models.Alias, names))
+    if existing:
+        raise DuplicateObjectError("Host or alias names already exist: "
+            + ", ".join(sorted(existing)))
+
+    candidates = _bulk_find_pools(records)
+    pools = [cands[0] if cands else None for cands in candidates]
+    now = datetime.datetime.now()
+    with transaction.atomic():
+        locked = set()
+        for cands in candidates:
+            for pool in cands:
+                if pool.pk not in locked:
+                    pool.lock()
+                    locked.add(pool.pk)
+
+        # explicit and EUI-64 addresses are reserved first so that automatic
+        # allocations do not take them
+        addrstrs = [None] * len(records)
+        for idx, rec in enumerate(records):
+            address = rec.get("address")
+            if not address and rec.get("eui64") and candidates[idx]:
+                pools[idx], address = _bulk_eui64(rec, candidates[idx])
+            if address:
+                addrstrs[idx] = pools[idx].reserve(address)
+        for idx, rec in enumerate(records):
+            if not candidates[idx] or addrstrs[idx] is not None:
+                continue
+            # the order of the pools of a category changes as they fill up
+            pool = min(candidates[idx], key=lambda poolobj: _category_key(
+                poolobj.used(), poolobj.len()))
+            pools[idx] = pool
+            if pool.used() >= pool.len():
+                if len(candidates[idx]) > 1:
+                    raise models.FullPoolError("No address available in "
+                        "pools from category " + rec["category"])
+                raise models.FullPoolError("No address available in pool "
+                    + pool.name)
+            addrstrs[idx] = pool.reserve(hint=rec.get("hint"),
+                rand=rec.get("random"))
+
+        models.Host.objects.bulk_create([models.Host(name=rec["host"],
+                category=rec.get("category") or "",
+                serial=rec.get("serial") or "",
+                inventory=rec.get("inventory") or "",
+                nodns=bool(rec.get("nodns")))
+            for rec in records])
+        hostids = {}
+        for chunk in _chunks([rec["host"] for rec in records]):
+            hostids.update(models.Host.objects.filter(name__in=chunk
+                ).values_list("name", "id"))
+
+        aliases = []
+        addrs = []
+        res = []
+        for idx, rec in enumerate(records):
+            hostid = hostids[rec["host"]]
+            for alia in rec.get("alias") or []:
+                aliases.append(models.Alias(name=alia, host_id=hostid))
+            addrstr = addrstrs[idx]
+            if pools[idx] is not None:
+                addrobj = models.Address(addr=addrstr, allocated=True,
+                    pool=pools[idx], host_id=hostid,
+                    macaddr=rec.get("mac") or "",
+                    addr_key=addrrange.addr_key(addrstr))
+                if rec.get("duration"):
+                    addrobj.duration = (now
+                        + datetime.timedelta(days=int(rec["duration"])))
+                addrs.append(addrobj)
+            elif rec.get("mac"):
+                addrs.append(models.Address(macaddr=rec["mac"],
+                    host_id=hostid))
+            res.append((rec["host"], addrstr))
+        models.Alias.objects.bulk_create(aliases)
+        try:
+            with transaction.atomic():
+                models.Address.objects.bulk_create(addrs)
+        except IntegrityError:
+            raise models.AddressNotAvailableError("Some addresses are already "
+                "allocated, the allocation maps may need to be checked.")
+
+        for pool in set(pool for pool in pools if pool is not None):
+            pool.save_reservations()
+        models.record_changes([pool.pk for pool in pools if pool is not None],
+            "import")
+
+    LOGGER.info("Imported " + str(len(records)) + " hosts.")
+    return res
+
+
 def delete(pool=None, addresses=None, hosts=None):
     """Delete objects from the database: address, host or pool."""
     if addresses:
@@ -747,8 +1129,9 @@ def sort_addresses(addrs):
         return addrs
     if not addrs[0].pool.addr_range:
         addrs[0].pool._update()
-    sortablefunc = addrs[0].pool.addr_range.sortable
-    return sorted(addrs, key=sortablefunc)
+    keys = addrs[0].pool.addr_range.sortables(addrs)
+    return [addrs[idx] for idx in sorted(xrange(len(addrs)),
+        key=keys.__getitem__)]
 
 
 def set_log_author(author):
@@ -762,6 +1145,24 @@ def delete_logs(days=0):
         models.LogEntry.objects.filter(date__lt=datetime.datetime.now()
             - datetime.timedelta(days=days)).delete()
 
+
+def delete_changes():
+    """Delete the entries of the change journal already rendered by every
+    generator. The newest entry is kept so that the revision numbers keep
+    increasing, and so is the newest pool entry which versions the pool
+    index."""
+    last = models.ChangeEntry.objects.aggregate(Max("id"))["id__max"]
+    if last is None:
+        return
+    oldest = generator.Config.objects.filter(revision__isnull=False
+        ).aggregate(Min("revision"))["revision__min"]
+    if oldest is not None:
+        last = min(last, oldest)
+    pool_entry = models.ChangeEntry.objects.filter(kind="pool").aggregate(
+        Max("id"))["id__max"]
+    models.ChangeEntry.objects.filter(id__lt=last).exclude(
+        id=pool_entry).delete()
+
 def export(cmd):
     """Export SLAM's command allowing to recreate the current database from
     scratch."""
@@ -829,21 +1230,9 @@ def export(cmd):
             res += cmd + " -a get -A " + addr.addr + option + "\n"
 
     for gen in models.Config.objects.all():
-        type_ = ""
-        if not gen.conftype:
-            continue
-        if gen.conftype == "bind":
-            type_ = "bind"
-        elif gen.conftype == "rbind":
-            type_ = "revbind"
-        elif gen.conftype == "dhcp":
-            type_ = "dhcp"
-        elif gen.conftype == "quatt":
-            type_ = "quattor"
-        elif gen.conftype == "laldns":
-            type_ = "laldns"
-        else:
+        if not generator.cast(gen):
             continue
+        type_ = gen.format_
 
         option = ""
         if gen.default:
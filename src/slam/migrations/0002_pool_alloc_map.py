@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slam', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pool',
+            name='alloc_map_str',
+            field=models.TextField(null=True, blank=True),
+        ),
+    ]
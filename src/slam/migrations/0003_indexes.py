@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import IntegrityError, migrations, models
+
+
+def _duplicates(queryset, *fields):
+    """Return the values of *fields* shared by several rows of *queryset*."""
+    return queryset.order_by().values_list(*fields).annotate(
+        count=models.Count("id")).filter(count__gt=1).values_list(*fields)
+
+
+def merge_duplicates(apps, schema_editor):
+    """Merge the hosts created several times with the same name and remove the
+    addresses allocated several times to the same host, so that the unique
+    constraints can be added. An address of a pool allocated to several hosts
+    cannot be merged: the migration fails with the list of these addresses."""
+    Host = apps.get_model("slam", "Host")
+    Alias = apps.get_model("slam", "Alias")
+    Address = apps.get_model("slam", "Address")
+    Property = apps.get_model("slam", "Property")
+
+    for (name,) in list(_duplicates(Host.objects, "name")):
+        host_ids = list(Host.objects.filter(name=name).order_by("id"
+            ).values_list("id", flat=True))
+        for model in (Alias, Address, Property):
+            model.objects.filter(host_id__in=host_ids[1:]).update(
+                host_id=host_ids[0])
+        Host.objects.filter(id__in=host_ids[1:]).delete()
+        for model in (Alias, Property):
+            for (prop_name,) in list(_duplicates(model.objects.filter(
+                    host_id=host_ids[0]), "name")):
+                model.objects.filter(id__in=list(model.objects.filter(
+                    host_id=host_ids[0], name=prop_name).order_by("id"
+                    ).values_list("id", flat=True))[1:]).delete()
+
+    conflicts = []
+    for pool_id, addr in list(_duplicates(Address.objects.filter(
+            pool__isnull=False), "pool_id", "addr")):
+        addrobjs = list(Address.objects.filter(pool_id=pool_id, addr=addr
+            ).order_by("id"))
+        if len(set(addrobj.host_id for addrobj in addrobjs)) > 1:
+            conflicts.append(addr + " (pool " + str(pool_id) + ")")
+            continue
+        macaddrs = [addrobj.macaddr for addrobj in addrobjs if addrobj.macaddr]
+        if macaddrs and not addrobjs[0].macaddr:
+            Address.objects.filter(id=addrobjs[0].id).update(
+                macaddr=macaddrs[0])
+        Address.objects.filter(id__in=[addrobj.id
+            for addrobj in addrobjs[1:]]).delete()
+    if schema_editor.connection.vendor == "postgresql":
+        # the tables cannot be altered with deferred checks pending
+        schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+    if conflicts:
+        raise IntegrityError("Addresses allocated to several hosts, free them "
+            "before migrating again: " + ", ".join(sorted(conflicts)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slam', '0002_pool_alloc_map'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='address',
+            name='addr',
+            field=models.CharField(db_index=True, max_length=40, blank=True),
+        ),
+        migrations.AlterField(
+            model_name='address',
+            name='macaddr',
+            field=models.CharField(db_index=True, max_length=17, blank=True),
+        ),
+        migrations.AlterField(
+            model_name='alias',
+            name='name',
+            field=models.CharField(max_length=50, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='host',
+            name='name',
+            field=models.CharField(unique=True, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='pool',
+            name='name',
+            field=models.CharField(db_index=True, max_length=50, blank=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='address',
+            unique_together=set([('pool', 'addr')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='address',
+            index_together=set([('pool', 'allocated', 'addr')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='property',
+            index_together=set([('host', 'name'), ('pool', 'name')]),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slam', '0003_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('pool_id', models.IntegerField(db_index=True, null=True, blank=True)),
+                ('kind', models.CharField(max_length=10, db_index=True)),
+                ('name', models.CharField(max_length=50, blank=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='config',
+            name='revision',
+            field=models.IntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='config',
+            name='checkfile_stamps',
+            field=models.TextField(null=True, blank=True),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+
+
+def _parse_ip4(addr):
+    """Return the integer value of the IPv4 address *addr*, or None."""
+    match = re.match(r"([0-9]{1,3})\." * 3 + r"([0-9]{1,3})", addr)
+    if match is None:
+        return None
+    res = 0
+    for i in range(1, 5):
+        if int(match.group(i)) > 255:
+            return None
+        res = res * 256 + int(match.group(i))
+    return res
+
+
+def _parse_ip6(addr):
+    """Return the integer value of the IPv6 address *addr*, or None."""
+    if addr == "::":
+        addr = (":0" * 8)[1:]
+    elif addr.find("::") >= 0:
+        abbrev = addr.find("::")
+        groups = addr.count(":")
+        if abbrev == 0 or abbrev == len(addr) - 2:
+            groups = groups - 1
+        add = (":0" * (8 - groups))[1:]
+        if abbrev == 0:
+            addr = add + addr[abbrev + 1:]
+        elif abbrev == len(addr) - 2:
+            addr = addr[:abbrev + 1] + add
+        else:
+            addr = addr[:abbrev + 1] + add + addr[abbrev + 1:]
+    match = re.match("([a-fA-F0-9]{1,4}):" * 7 + "([a-fA-F0-9]{1,4})", addr)
+    if match is None:
+        return None
+    res = 0
+    for i in range(1, 9):
+        res = res * (2 ** 16) + int(match.group(i), 16)
+    return res
+
+
+def _addr_key(addr):
+    """Return the key of 32 hexadecimal digits of the IP address *addr*, or
+    None, as computed by slam.addrrange.addr_key when this migration was
+    written."""
+    if ":" in addr:
+        value = _parse_ip6(addr)
+    else:
+        value = _parse_ip4(addr)
+    if value is None:
+        return None
+    return "%032x" % value
+
+
+def fill_addr_keys(apps, schema_editor):
+    """Compute the key of the existing addresses."""
+    Address = apps.get_model("slam", "Address")
+    for pk, addr in Address.objects.values_list("pk", "addr").iterator():
+        key = _addr_key(addr)
+        if key is not None:
+            Address.objects.filter(pk=pk).update(addr_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slam', '0004_change_journal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='addr_key',
+            field=models.CharField(db_index=True, max_length=32, null=True, blank=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='address',
+            index_together=set([('pool', 'allocated', 'addr'), ('pool', 'addr_key')]),
+        ),
+        migrations.RunPython(fill_addr_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_categories(apps, schema_editor):
+    """Index the categories of the existing pools."""
+    Pool = apps.get_model("slam", "Pool")
+    Category = apps.get_model("slam", "Category")
+    for pool in Pool.objects.exclude(category=""):
+        pool.categories.add(*[Category.objects.get_or_create(name=name)[0]
+            for name in set(pool.category.split(",")) if name])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slam', '0005_address_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(unique=True, max_length=50)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AlterField(
+            model_name='host',
+            name='category',
+            field=models.CharField(db_index=True, max_length=20, blank=True),
+        ),
+        migrations.AddField(
+            model_name='pool',
+            name='categories',
+            field=models.ManyToManyField(to='slam.Category', blank=True),
+        ),
+        migrations.RunPython(fill_categories, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations
+
+
+def _parse_ip4(addr):
+    """Return the integer value of the IPv4 address *addr*, or None."""
+    match = re.match(r"([0-9]{1,3})\." * 3 + r"([0-9]{1,3})", addr)
+    if match is None:
+        return None
+    res = 0
+    for i in range(1, 5):
+        if int(match.group(i)) > 255:
+            return None
+        res = res * 256 + int(match.group(i))
+    return res
+
+
+def _parse_ip6(addr):
+    """Return the integer value of the IPv6 address *addr*, or None."""
+    if addr == "::":
+        addr = (":0" * 8)[1:]
+    elif addr.find("::") >= 0:
+        abbrev = addr.find("::")
+        groups = addr.count(":")
+        if abbrev == 0 or abbrev == len(addr) - 2:
+            groups = groups - 1
+        add = (":0" * (8 - groups))[1:]
+        if abbrev == 0:
+            addr = add + addr[abbrev + 1:]
+        elif abbrev == len(addr) - 2:
+            addr = addr[:abbrev + 1] + add
+        else:
+            addr = addr[:abbrev + 1] + add + addr[abbrev + 1:]
+    match = re.match("([a-fA-F0-9]{1,4}):" * 7 + "([a-fA-F0-9]{1,4})", addr)
+    if match is None:
+        return None
+    res = 0
+    for i in range(1, 9):
+        res = res * (2 ** 16) + int(match.group(i), 16)
+    return res
+
+
+def _addr_key(addr):
+    """Return the key of 32 hexadecimal digits of the IP address *addr*, or
+    None, as computed by slam.addrrange.addr_key when this migration was
+    written."""
+    if ":" in addr:
+        value = _parse_ip6(addr)
+    else:
+        value = _parse_ip4(addr)
+    if value is None:
+        return None
+    return "%032x" % value
+
+
+def _set_key(addr):
+    """Return the sort key of an address of a set pool: the IP addresses come
+    first in address order, then the other names."""
+    key = _addr_key(addr)
+    if key is None:
+        return (1, "", addr)
+    return (0, key, addr)
+
+
+def sort_addr_sets(apps, schema_editor):
+    """Store the addresses of the set pools sorted and invalidate their
+    allocation map, whose offsets followed the former iteration order."""
+    Pool = apps.get_model("slam", "Pool")
+    for pool in Pool.objects.filter(addr_range_type="set"):
+        addrs = set(pool.addr_range_str.split(","))
+        addrs.discard("")
+        Pool.objects.filter(pk=pool.pk).update(
+            addr_range_str=",".join(sorted(addrs, key=_set_key)),
+            alloc_map_str=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slam', '0006_categories'),
+    ]
+
+    operations = [
+        migrations.RunPython(sort_addr_sets, migrations.RunPython.noop),
+    ]
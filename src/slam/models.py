@@ -1,9 +1,16 @@
 """Module containing all the models used by the SLAM application."""
 
 import random
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
 from slam import addrrange
+from slam.allocmap import AllocMap
+
+# Number of random offsets tried before picking among the free addresses
+RAND_TRIES = 16
+
 
 class FullPoolError(Exception):
     """The pool does not have any available addresses."""
@@ -41,8 +48,8 @@ class Host(SLAMBaseModel):
     have one or several network addresses.
     """
 
-    name = models.CharField(max_length=50)
-    category = models.CharField(max_length=20, blank=True)
+    name = models.CharField(max_length=50, unique=True)
+    category = models.CharField(max_length=20, blank=True, db_index=True)
     serial = models.CharField(max_length=50, blank=True)
     inventory = models.CharField(max_length=50, blank=True)
     nodns = models.BooleanField(default=False)
@@ -62,13 +69,22 @@ class Alias(SLAMBaseModel):
 
     aliastype = models.CharField(choices=ALIAS_TYPE, max_length=4,
         default="name")
-    name = models.CharField(max_length=50)
+    name = models.CharField(max_length=50, db_index=True)
     host = models.ForeignKey(Host)
 
     def __unicode__(self):
         return self.name
 
 
+class Category(SLAMBaseModel):
+    """A category of pools, used to allocate an address in any of them."""
+
+    name = models.CharField(max_length=50, unique=True)
+
+    def __unicode__(self):
+        return self.name
+
+
 class Pool(SLAMBaseModel):
     """Define a pool of addresses, keeping track of which addresses are in
     use."""
@@ -79,13 +95,17 @@ class Pool(SLAMBaseModel):
         ('set', 'Address set'),
     )
 
-    name = models.CharField(max_length=50, blank=True)
+    name = models.CharField(max_length=50, blank=True, db_index=True)
     category = models.TextField(blank=True)
     addr_range_type = models.CharField(max_length=5, choices=ADDR_RANGE_CHOICE)
     addr_range_str = models.TextField(blank=True)
     dns_record = models.CharField(max_length=10)
     addr_range = None
+    alloc_map_str = models.TextField(blank=True, null=True)
+    alloc_map = None
     generator = models.ManyToManyField(Config)
+    # indexed copy of the comma-separated category field
+    categories = models.ManyToManyField(Category, blank=True)
 
     @classmethod
     def create(cls, name=None, addr_range=None,
@@ -105,62 +125,155 @@ class Pool(SLAMBaseModel):
 
         pool = cls(name=name, addr_range_type=addr_range.range_type,
             addr_range_str=str(addr_range), dns_record=addr_range.dns_record,
-            category=category)
+            category=category, alloc_map_str="")
         pool.addr_range = addr_range
+        pool.alloc_map = AllocMap()
         return pool
 
     def _update(self):
         """Restore an address range class from the serialized data."""
-        if self.addr_range_type == 'ip4':
-            self.addr_range = addrrange.Ip4Range(self.addr_range_str)
-        elif self.addr_range_type == 'ip6':
-            self.addr_range = addrrange.Ip6Range(self.addr_range_str)
-        else: # set
-            addrset = set()
-            if len(self.addr_range_str) > 0:
-                addrset = set(str(self.addr_range_str).split(","))
-            self.addr_range = addrrange.AddrSet(addrset, self.dns_record)
-
-    def get(self):
-        """Get the first available address in the pool."""
+        self.addr_range = addrrange.RANGE_CACHE.get(self.addr_range_type,
+            self.addr_range_str, self.dns_record)
+
+    def _rebuild_alloc_map(self):
+        """Return an allocation map computed from the addresses allocated in
+        this pool."""
         if self.addr_range is None:
             self._update()
-        res = None
-        for addr in self.addr_range:
-            if res is not None:
-                break
-            if not Address.objects.filter(
-                    allocated=True, pool=self, addr=addr):
-                res = addr
-        if res is None:
-            raise FullPoolError("The pool \"" + self.name + "\" is full.")
-        addr = Address(addr=res, allocated=True, pool=self)
-        addr.save()
+        alloc_map = AllocMap()
+        for addr in Address.objects.filter(allocated=True, pool=self
+                ).values_list("addr", flat=True):
+            if addr in self.addr_range:
+                alloc_map.add(self.addr_range.index(addr))
+        return alloc_map
+
+    def _update_alloc_map(self):
+        """Restore the allocation map from the serialized data, it is rebuilt
+        from the allocated addresses if it was invalidated."""
+        if self.alloc_map_str is None:
+            self.alloc_map = self._rebuild_alloc_map()
+            self._save_alloc_map()
+        else:
+            self.alloc_map = AllocMap(self.alloc_map_str)
+
+    def _lock_alloc_map(self):
+        """Reload the allocation map from the database and lock the pool until
+        the end of the current transaction."""
+        self.alloc_map_str = Pool.objects.select_for_update().filter(
+            pk=self.pk).values_list("alloc_map_str", flat=True).get()
+        if self.alloc_map_str is None:
+            self.alloc_map = self._rebuild_alloc_map()
+        else:
+            self.alloc_map = AllocMap(self.alloc_map_str)
+
+    def _save_alloc_map(self):
+        """Store the allocation map without touching the other fields."""
+        self.alloc_map_str = str(self.alloc_map)
+        Pool.objects.filter(pk=self.pk).update(alloc_map_str=self.alloc_map_str)
+
+    def rebuild_alloc_map(self):
+        """Check the allocation map against the allocated addresses, rebuild it
+        if they do not match and return true if it was consistent."""
+        if self.alloc_map is None:
+            self._update_alloc_map()
+        alloc_map = self._rebuild_alloc_map()
+        if alloc_map == self.alloc_map:
+            return True
+        self.alloc_map = alloc_map
+        self._save_alloc_map()
+        return False
+
+    def _new_address(self, offset, host=None):
+        """Allocate the address at *offset* in the range."""
+        addr = Address(addr=self.addr_range[offset], allocated=True, pool=self,
+            host=host)
+        addr.alloc_map_updated = True
+        try:
+            with transaction.atomic():
+                addr.save()
+        except IntegrityError:
+            # allocated concurrently by another process or outside of the Pool
+            # methods: the map is stale, mark the offset as used
+            self.alloc_map.add(offset)
+            self._save_alloc_map()
+            raise AddressNotAvailableError("Address \"" + addr.addr
+                + "\" is not available.")
+        self.alloc_map.add(offset)
+        self._save_alloc_map()
         return addr
 
-    def get_rand(self):
-        """Get a random available address in the pool."""
+    def get(self, hint=None):
+        """Get the first available address in the pool, starting the search at
+        the address *hint* if given and wrapping around the end of the
+        pool."""
         if self.addr_range is None:
             self._update()
-        len_ = self.addr_range.len()
-        i = len_
-        res = None
-        while i > 0 and res is None:
-            i = i - 1
-            addr = self.addr_range[random.randint(0, len_ - 1)]
-            if not Address.objects.filter(
-                    allocated=True, pool=self, addr=addr):
-                res = addr
-
-        # no result with the random: either the pull is full or we were unlucky
-        if res is None:
-            # try the linear method
-            return self.get()
-        else:
-            addrobj = Address(addr=res, allocated=True, pool=self)
-            addrobj.save()
-
-        return addrobj
+        start = 0
+        if hint is not None:
+            if hint not in self.addr_range:
+                raise AddressNotInPoolError("Address \"" + hint
+                    + "\" is not in pool: " + self.name)
+            start = self.addr_range.index(hint)
+        with transaction.atomic():
+            self._lock_alloc_map()
+            while True:
+                res = self.alloc_map.first_free(self.addr_range.len(), start)
+                if res is None and start > 0:
+                    res = self.alloc_map.first_free(self.addr_range.len())
+                if res is None:
+                    raise FullPoolError("The pool \"" + self.name
+                        + "\" is full.")
+                try:
+                    return self._new_address(res)
+                except AddressNotAvailableError:
+                    # the offset is now marked as used, try the next one
+                    pass
+
+    def get_rand(self, seed=None):
+        """Get an address picked uniformly among the available addresses of the
+        pool. Giving a *seed* makes the choice reproducible."""
+        if self.addr_range is None:
+            self._update()
+        rand = random.Random(seed)
+        with transaction.atomic():
+            self._lock_alloc_map()
+            size = self.addr_range.len()
+            while True:
+                used = self.alloc_map.len()
+                if size - used <= 0:
+                    raise FullPoolError("The pool \"" + self.name
+                        + "\" is full.")
+                offset = None
+                if used * 2 <= size:
+                    # sparse pool: picking any offset almost always hits a free
+                    # one
+                    for _ in range(RAND_TRIES):
+                        offset = rand.randrange(size)
+                        if offset not in self.alloc_map:
+                            break
+                        offset = None
+                if offset is None:
+                    offset = self.alloc_map.nth_free(
+                        rand.randrange(size - used))
+                try:
+                    return self._new_address(offset)
+                except AddressNotAvailableError:
+                    # the offset is now marked as used, draw another one
+                    pass
+
+    def get_eui64(self, mac, host=None):
+        """Get the address of an IPv6 pool derived from the MAC address *mac*
+        with the modified EUI-64 format."""
+        if self.addr_range is None:
+            self._update()
+        if self.addr_range_type != "ip6":
+            raise AddressNotInPoolError("EUI-64 addresses can only be "
+                + "allocated in IPv6 pools: " + self.name)
+        try:
+            addr = self.addr_range.eui64(mac)
+        except addrrange.InvalidAddressError as exc:
+            raise AddressNotInPoolError(str(exc))
+        return self.allocate(addr, host)
 
     def allocate(self, addr, host=None):
         """Mark the address *addr* of the pool as allocated."""
@@ -169,15 +282,13 @@ class Pool(SLAMBaseModel):
         if addr not in self.addr_range:
             raise AddressNotInPoolError("Address \"" + addr
                 + "\" is not in pool: " + self.name)
-        if Address.objects.filter(allocated=True, pool=self, addr=addr):
-            raise AddressNotAvailableError("Address \"" + addr
-                + "\" is not available.")
-        if host is None:
-            newaddr = Address(addr=addr, allocated=True, pool=self)
-        else:
-            newaddr = Address(addr=addr, allocated=True, pool=self, host=host)
-        newaddr.save()
-        return newaddr
+        with transaction.atomic():
+            self._lock_alloc_map()
+            offset = self.addr_range.index(addr)
+            if offset in self.alloc_map:
+                raise AddressNotAvailableError("Address \"" + addr
+                    + "\" is not available.")
+            return self._new_address(offset, host)
 
     def free(self, addr):
         """Mark the address *addr* of the pool as available."""
@@ -187,11 +298,63 @@ class Pool(SLAMBaseModel):
             raise AddressNotInPoolError("Could not delete address \"" + addr
                 + "\": the address is not in the given pool")
 
-        addr_qs = Address.objects.filter(addr=addr, allocated=True, pool=self)
-        if addr_qs.count() == 0:
-            raise AddressNotAllocatedError("Could not delete address \"" + addr
-                + "\": the address is not allocated")
-        addr_qs.delete()
+        with transaction.atomic():
+            self._lock_alloc_map()
+            addrobjs = list(Address.objects.filter(addr=addr, allocated=True,
+                pool=self))
+            if not addrobjs:
+                raise AddressNotAllocatedError("Could not delete address \""
+                    + addr + "\": the address is not allocated")
+            for addrobj in addrobjs:
+                addrobj.alloc_map_updated = True
+                addrobj.delete()
+            self.alloc_map.remove(self.addr_range.index(addr))
+            self._save_alloc_map()
+
+    def lock(self):
+        """Lock the pool until the end of the current transaction and reload
+        its allocation map, before a batch of :meth:`reserve` calls."""
+        if self.addr_range is None:
+            self._update()
+        self._lock_alloc_map()
+
+    def reserve(self, addr=None, hint=None, rand=False):
+        """Reserve in the allocation map of a pool locked by :meth:`lock` the
+        address *addr*, a random available address with *rand*, or the first
+        available address starting at *hint*, and return it. The caller
+        creates the addresses and stores the map with
+        :meth:`save_reservations`."""
+        if addr is not None:
+            if addr not in self.addr_range:
+                raise AddressNotInPoolError("Address \"" + addr
+                    + "\" is not in pool: " + self.name)
+            offset = self.addr_range.index(addr)
+            if offset in self.alloc_map:
+                raise AddressNotAvailableError("Address \"" + addr
+                    + "\" is not available.")
+        else:
+            size = self.addr_range.len()
+            free = size - self.alloc_map.len()
+            if free <= 0:
+                raise FullPoolError("The pool \"" + self.name + "\" is full.")
+            if rand:
+                offset = self.alloc_map.nth_free(random.randrange(free))
+            else:
+                start = 0
+                if hint is not None:
+                    if hint not in self.addr_range:
+                        raise AddressNotInPoolError("Address \"" + hint
+                            + "\" is not in pool: " + self.name)
+                    start = self.addr_range.index(hint)
+                offset = self.alloc_map.first_free(size, start)
+                if offset is None:
+                    offset = self.alloc_map.first_free(size)
+        self.alloc_map.add(offset)
+        return self.addr_range[offset]
+
+    def save_reservations(self):
+        """Store the allocation map updated by :meth:`reserve`."""
+        self._save_alloc_map()
 
     def isallocated(self, addr):
         """Return true if the address *addr* is already in use."""
@@ -200,13 +363,23 @@ class Pool(SLAMBaseModel):
         if addr not in self.addr_range:
             raise AddressNotInPoolError("Address \"" + addr
                 + "\" is not in the pool: " + self.name)
-        return Address.objects.filter(allocated=True, pool=self, addr=addr)
+        return self.addr_range.index(addr) in self.get_alloc_map()
 
     def __contains__(self, addr):
         if self.addr_range is None:
             self._update()
-        return (Address.objects.filter(allocated=True, pool=self, addr=addr)
-            or addr in self.addr_range)
+        return addr in self.addr_range
+
+    def get_alloc_map(self):
+        """Return the allocation map of the pool, rebuilt from the allocated
+        addresses if it was invalidated."""
+        if self.alloc_map is None:
+            self._update_alloc_map()
+        return self.alloc_map
+
+    def used(self):
+        """Return the number of allocated addresses in the pool."""
+        return self.get_alloc_map().len()
 
     def len(self):
         """Return the number of element in the range."""
@@ -220,11 +393,27 @@ class Pool(SLAMBaseModel):
         return self.name + " (range: " + str(self.addr_range) + ")"
 
 
+class AddressQuerySet(models.QuerySet):
+    """Queries on addresses using their numeric keys."""
+
+    def between(self, first, last):
+        """Return the IP addresses from *first* to *last* included."""
+        return self.filter(addr_key__gte=addrrange.addr_key(first),
+            addr_key__lte=addrrange.addr_key(last))
+
+    def order_by_addr(self):
+        """Order IP addresses numerically and the other ones by name."""
+        return self.order_by("addr_key", "addr")
+
+
 class Address(SLAMBaseModel):
     """Represent a network address."""
 
-    addr = models.CharField(max_length=40, blank=True)
-    macaddr = models.CharField(max_length=17, blank=True)
+    addr = models.CharField(max_length=40, blank=True, db_index=True)
+    # numeric order of IP addresses, see addrrange.addr_key
+    addr_key = models.CharField(max_length=32, blank=True, null=True,
+        db_index=True)
+    macaddr = models.CharField(max_length=17, blank=True, db_index=True)
     allocated = models.BooleanField(default=False)
     pool = models.ForeignKey(Pool, blank=True, null=True)
     host = models.ForeignKey(Host, null=True, blank=True)
@@ -233,9 +422,36 @@ class Address(SLAMBaseModel):
     lastuse = models.DateTimeField(blank=True, null=True)
     comment = models.TextField(blank=True)
 
+    class Meta(SLAMBaseModel.Meta):
+        """An address can only be allocated once in a pool."""
+        unique_together = (("pool", "addr"),)
+        index_together = (("pool", "allocated", "addr"), ("pool", "addr_key"))
+
+    objects = AddressQuerySet.as_manager()
+
     def __unicode__(self):
         return self.addr
 
+    def save(self, *args, **kwargs):
+        """Update the key of the address before saving it."""
+        self.addr_key = addrrange.addr_key(self.addr)
+        super(Address, self).save(*args, **kwargs)
+
+
+@receiver(post_save, sender=Address)
+@receiver(post_delete, sender=Address)
+def _invalidate_alloc_map(sender, instance, **kwargs):
+    """Invalidate the allocation map of the pool of an address created or
+    deleted outside of the Pool methods, such as on a cascade deletion of its
+    host. The Pool methods mark their addresses as they store their updated
+    map right afterwards."""
+    if getattr(instance, "alloc_map_updated", False):
+        return
+    if instance.allocated and instance.pool_id is not None and (
+            kwargs.get("created", True)):
+        Pool.objects.filter(pk=instance.pool_id).exclude(
+            alloc_map_str=None).update(alloc_map_str=None)
+
 
 class Property(SLAMBaseModel):
     """Represent a property of an object."""
@@ -245,5 +461,81 @@ class Property(SLAMBaseModel):
     pool = models.ForeignKey(Pool, blank=True, null=True)
     host = models.ForeignKey(Host, blank=True, null=True)
 
+    class Meta(SLAMBaseModel.Meta):
+        """Properties are looked up by name on their host or pool."""
+        index_together = (("host", "name"), ("pool", "name"))
+
     def __unicode__(self):
         return self.name + ": " + self.value
+
+
+class ChangeEntry(SLAMBaseModel):
+    """Entry of the change journal: the id is a revision number increasing
+    with every change to the hosts of a pool. A null pool means that all the
+    pools may be affected."""
+
+    date = models.DateTimeField(auto_now_add=True)
+    pool_id = models.IntegerField(blank=True, null=True, db_index=True)
+    kind = models.CharField(max_length=10, db_index=True)
+    name = models.CharField(max_length=50, blank=True)
+
+    def __unicode__(self):
+        return (str(self.id) + ": " + self.kind + " " + self.name
+            + " (pool: " + str(self.pool_id) + ")")
+
+
+def record_changes(pool_ids, kind, name=""):
+    """Add an entry to the change journal for every pool of *pool_ids*."""
+    ChangeEntry.objects.bulk_create([ChangeEntry(pool_id=pool_id, kind=kind,
+        name=name[:50]) for pool_id in set(pool_ids)])
+
+
+def _host_pool_ids(host_id):
+    """Return the ids of the pools in which the host has addresses."""
+    return Address.objects.filter(host_id=host_id, pool__isnull=False
+        ).values_list("pool_id", flat=True)
+
+
+@receiver(post_save, sender=Address)
+@receiver(post_delete, sender=Address)
+def _journal_address(sender, instance, **kwargs):
+    """Record the changes of the addresses in their pool."""
+    if instance.pool_id is not None:
+        record_changes([instance.pool_id], "address", instance.addr)
+
+
+@receiver(post_save, sender=Host)
+@receiver(post_save, sender=Alias)
+@receiver(post_delete, sender=Alias)
+@receiver(post_save, sender=Property)
+@receiver(post_delete, sender=Property)
+def _journal_host(sender, instance, **kwargs):
+    """Record the changes of a host, of its aliases or of a property in the
+    pools of the host addresses, or in the pool of the property."""
+    if sender is Host:
+        record_changes(_host_pool_ids(instance.pk), "host", instance.name)
+    elif sender is Property and instance.pool_id is not None:
+        record_changes([instance.pool_id], "property", instance.name)
+    elif instance.host_id is not None:
+        record_changes(_host_pool_ids(instance.host_id),
+            sender.__name__.lower(), instance.name)
+
+
+@receiver(post_save, sender=Pool)
+def _index_categories(sender, instance, **kwargs):
+    """Update the categories table from the category field of a pool."""
+    names = set(name for name in instance.category.split(",") if name)
+    if names != set(instance.categories.values_list("name", flat=True)):
+        instance.categories = [Category.objects.get_or_create(name=name)[0]
+            for name in names]
+
+
+@receiver(post_save, sender=Pool)
+@receiver(post_delete, sender=Pool)
+def _journal_pool(sender, instance, **kwargs):
+    """Record the changes of a pool, its removal may affect every generator
+    using it."""
+    if kwargs["signal"] is post_delete:
+        record_changes([None], "pool", instance.name)
+    else:
+        record_changes([instance.pk], "pool", instance.name)
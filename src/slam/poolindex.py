@@ -0,0 +1,146 @@
+"""Index of the address ranges of all the pools, used to find the pool of an
+address without testing every pool."""
+
+import bisect, heapq
+from django.db.models import Max
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from slam import addrrange, models
+
+
+class IntervalIndex:
+    """Sorted disjoint intervals of integers. Where the intervals it is built
+    from overlap, the lowest key owns the addresses."""
+
+    def __init__(self, intervals=()):
+        """Build the index from a list of (first, last, key) tuples."""
+        self.starts = []
+        self.ends = []
+        self.keys = []
+        intervals = sorted(intervals)
+        bounds = sorted(set([first for first, _, _ in intervals]
+            + [last + 1 for _, last, _ in intervals]))
+        # sweep the bounds, keeping the intervals covering the current one in
+        # a heap ordered by key
+        active = []
+        pos = 0
+        for start, stop in zip(bounds, bounds[1:]):
+            while pos < len(intervals) and intervals[pos][0] == start:
+                heapq.heappush(active, (intervals[pos][2], intervals[pos][1]))
+                pos += 1
+            while active and active[0][1] < start:
+                heapq.heappop(active)
+            if not active:
+                continue
+            key = active[0][0]
+            if self.keys and self.keys[-1] == key and self.ends[-1] == start - 1:
+                self.ends[-1] = stop - 1
+            else:
+                self.starts.append(start)
+                self.ends.append(stop - 1)
+                self.keys.append(key)
+
+    def find(self, value):
+        """Return the key owning *value*, or None."""
+        idx = bisect.bisect_right(self.starts, value) - 1
+        if idx >= 0 and value <= self.ends[idx]:
+            return self.keys[idx]
+        return None
+
+    def overlapping(self, first, last):
+        """Return the keys owning a value between *first* and *last*."""
+        res = set()
+        idx = max(bisect.bisect_right(self.starts, first) - 1, 0)
+        while idx < len(self.starts) and self.starts[idx] <= last:
+            if self.ends[idx] >= first:
+                res.add(self.keys[idx])
+            idx += 1
+        return res
+
+
+def _bounds(addr_range):
+    """Return the first and last integer addresses of an IPv4 or IPv6 range."""
+    return addr_range.net, addr_range.net + addr_range.len() - 1
+
+
+class PoolIndex:
+    """Find the pool of an address with a bisection in the IPv4 and IPv6 pool
+    ranges and a hash of the addresses of the set pools. An address in several
+    pools belongs to the one with the lowest id."""
+
+    def __init__(self, pools):
+        """Build the index from a list of (id, range) tuples."""
+        intervals = {"ip4": [], "ip6": []}
+        self.addrs = {}
+        for pool_id, addr_range in sorted(pools):
+            if addr_range.range_type in intervals:
+                first, last = _bounds(addr_range)
+                intervals[addr_range.range_type].append(
+                    (first, last, pool_id))
+            else:
+                for addr in addr_range:
+                    self.addrs.setdefault(addr, pool_id)
+        self.ip4 = IntervalIndex(intervals["ip4"])
+        self.ip6 = IntervalIndex(intervals["ip6"])
+
+    def find(self, addr):
+        """Return the id of the pool of the address *addr*, or None."""
+        res = [self.addrs.get(addr)]
+        try:
+            res.append(self.ip4.find(addrrange._parse_ip4(addr)))
+        except addrrange.InvalidAddressError:
+            pass
+        try:
+            res.append(self.ip6.find(addrrange._parse_ip6(addr)))
+        except addrrange.InvalidAddressError:
+            pass
+        res = [pool_id for pool_id in res if pool_id is not None]
+        if not res:
+            return None
+        return min(res)
+
+    def overlapping(self, addr_range):
+        """Return the ids of the pools sharing addresses with *addr_range*."""
+        if addr_range.range_type == "ip4":
+            return self.ip4.overlapping(*_bounds(addr_range))
+        elif addr_range.range_type == "ip6":
+            return self.ip6.overlapping(*_bounds(addr_range))
+        res = set(self.find(addr) for addr in addr_range)
+        res.discard(None)
+        return res
+
+
+# index of the pools and the last pool change of the journal it was built from
+_INDEX = {}
+
+
+@receiver(post_save, sender=models.Pool)
+@receiver(post_delete, sender=models.Pool)
+def _invalidate_index(sender, instance, **kwargs):
+    """Drop the index when a pool is created, modified or removed."""
+    _INDEX.clear()
+
+
+def get_index():
+    """Return the index of the current pools. Pools created, modified or
+    removed by another process are noticed from the last pool entry of the
+    change journal, whose ids always increase unlike the ids of the pools."""
+    version = models.ChangeEntry.objects.filter(kind="pool").aggregate(
+        Max("id"))["id__max"]
+    if "index" not in _INDEX or _INDEX["version"] != version:
+        index = PoolIndex([(pool_id, addrrange.RANGE_CACHE.get(range_type,
+                range_str, dns_record)) for pool_id, range_type, range_str,
+            dns_record in models.Pool.objects.values_list("id",
+                "addr_range_type", "addr_range_str", "dns_record")])
+        _INDEX.clear()
+        _INDEX.update(version=version, index=index)
+    return _INDEX["index"]
+
+
+def find_pool(addr):
+    """Return the pool of the address *addr*, or None."""
+    pool_id = get_index().find(addr)
+    if pool_id is None:
+        return None
+    return models.Pool.objects.get(pk=pool_id)
@@ -8,6 +8,8 @@ import pwd
 import argparse
 import logging
 import signal
+import csv
+import json
 
 os.environ["DJANGO_SETTINGS_MODULE"] = "webinterface.settings"
 
@@ -23,9 +25,11 @@ def init_argparser():
         description= "SLAM command-line interface")
     argparser.add_argument("-a", "--action", action="append", required=True,
         choices=["list", "create", "get", "delete", "modify", "setprop",
-            "rmprop", "createconf", "upconf", "log", "export"],
+            "rmprop", "createconf", "upconf", "log", "export", "checkmap",
+            "import"],
         help="The action to perform: list | create | get | delete | modify "
-            + "| setprop | rmprop | createconf | upconf | export")
+            + "| setprop | rmprop | createconf | upconf | export | checkmap "
+            + "| import")
     argparser.add_argument("-pn", "--pool-name", action="append",
         help="The name of an address pool.")
     argparser.add_argument("-c", "--category", action="append",
@@ -41,6 +45,11 @@ def init_argparser():
         help="The name of the host to manage.")
     argparser.add_argument("-r", "--random", action="store_true",
         help="Hosts will get random addresses from the pool.")
+    argparser.add_argument("--hint", action="store",
+        help="Address from which to search for an available address.")
+    argparser.add_argument("--eui64", action="store_true",
+        help="Hosts will get the address of an IPv6 pool derived from their "
+            + "MAC address.")
     argparser.add_argument("-g", "--generator", action="store",
         help="Name of the configuration generator.")
     argparser.add_argument("-o", "--output", action="store",
@@ -54,6 +63,8 @@ def init_argparser():
         help="Footer file path for the configuration files to generate.")
     argparser.add_argument("--checkfile", action="append",
         help="Files to scan for duplicates while generating configuration.")
+    argparser.add_argument("--jobs", action="store", type=int, default=1,
+        help="Number of configuration files to generate concurrently.")
     argparser.add_argument("--timeout", action="store",
         help="Timeout for the generated configuration (ie: bind...).")
     argparser.add_argument("--domain", action="store",
@@ -113,7 +124,7 @@ def generate(args):
             pool_name=args.pool_name, conf_format=args.extra[0],
             output=args.output, header=args.header, footer=args.footer,
             checkfile=args.checkfile, timeout=args.timeout, domain=args.domain,
-            update=(args.action=="upconf"))
+            update=(args.action=="upconf"), jobs=args.jobs)
     except (IOError, interface.InexistantObjectError,
             interface.ConfigurationFormatError,
             generator.DuplicateRecordError) as exc:
@@ -178,7 +189,7 @@ def _list_hosts(args):
             if hostobj.nodns:
                 print("NODNS")
             for addr in models.Address.objects.filter(host=hostobj).exclude(
-                    addr="").order_by("addr"):
+                    addr="").order_by_addr():
                 if addr.pool:
                     print ("Address " + str(addr) + " (pool: " +
                         addr.pool.name + ")")
@@ -241,14 +252,14 @@ def list_(args):
             logging.error(str(exc))
             sys.exit(1)
 
-        used = models.Address.objects.filter(pool=pool).count()
-        tot = pool.len()
+        _, used, tot, perc = interface.pool_stats(
+            models.Pool.objects.filter(pk=pool.pk))[0]
         print("Pool: " + str(pool) + ", " + str(used) + "/" + str(tot)
-            + " (" + str(used * 100 / tot) + "%)")
+            + " (" + str(perc) + "%)")
         if pool.category:
             print("Categories: " + ", ".join(pool.category.split(",")))
-        addrs = list(models.Address.objects.filter(pool=pool))
-        addrs = interface.sort_addresses(addrs)
+        addrs = models.Address.objects.filter(pool=pool).order_by_addr(
+            ).select_related("host")
         for addr in addrs:
             print str(addr) + "\t\t" + str(addr.host)
         for prop in models.Property.objects.filter(pool=pool).order_by("name"):
@@ -278,8 +289,9 @@ def list_(args):
         _list_generator(args)
     else:
         print "Address pools:"
-        for pool in models.Pool.objects.all().order_by("name"):
-            print str(pool)
+        for pool, used, tot, perc in interface.pool_stats():
+            print(str(pool) + ", " + str(used) + "/" + str(tot)
+                + " (" + str(perc) + "%)")
 
 
 def get(args):
@@ -308,7 +320,8 @@ def get(args):
                 if args.category:
                     args.category = args.category[0]
                 addr = interface.allocate_address(pool, hostobj,
-                    args.address[0], args.random, args.category, args.duration)
+                    args.address[0], args.random, args.category, args.duration,
+                    args.hint, args.eui64)
                 del args.address[0]
             except (interface.MissingParameterError,
                     models.FullPoolError) as exc:
@@ -341,7 +354,7 @@ def _create_host(args, pool):
             hostres, addrres = interface.create_host(host, pool,
                 args.address[0], macaddr, args.random, args.alias,
                 args.category[0], args.serial, args.inventory, args.duration,
-                args.nodns)
+                args.nodns, args.hint, args.eui64)
             if addrres is None:
                 print ("Host \"" + hostres + "\" have been created.")
             else:
@@ -349,7 +362,8 @@ def _create_host(args, pool):
         except (models.AddressNotInPoolError,
                 models.AddressNotAvailableError,
                 models.FullPoolError,
-                interface.DuplicateObjectError) as exc:
+                interface.DuplicateObjectError,
+                interface.MissingParameterError) as exc:
             logging.error(str(exc))
             sys.exit(1)
         del args.address[0]
@@ -420,6 +434,68 @@ def create(args):
             sys.exit(1)
 
 
+def _read_records(stream):
+    """Read host records from a file of JSON objects, one per line, or from a
+    CSV file whose first line gives the column names."""
+    lines = [line for line in stream if line.strip()]
+    if not lines:
+        return []
+    if lines[0].lstrip().startswith("{"):
+        records = [json.loads(line) for line in lines]
+    else:
+        records = []
+        for row in csv.DictReader(lines):
+            records.append(dict((key.strip(), value.strip())
+                for key, value in row.items() if key and value))
+    for rec in records:
+        for key, value in rec.items():
+            if isinstance(value, unicode):
+                rec[key] = value.encode("utf-8")
+        if isinstance(rec.get("alias"), str):
+            rec["alias"] = [alia for alia in rec["alias"].split(",") if alia]
+        if isinstance(rec.get("nodns"), str):
+            rec["nodns"] = rec["nodns"].lower() in ["1", "true", "yes"]
+        for key in ["random", "eui64"]:
+            if isinstance(rec.get(key), str):
+                rec[key] = rec[key].lower() in ["1", "true", "yes"]
+        if rec.get("duration"):
+            rec["duration"] = int(rec["duration"])
+    return records
+
+
+def import_(args):
+    """Create the hosts listed in the given files, or on the standard input."""
+    records = []
+    try:
+        for path in args.extra or ["-"]:
+            if path == "-":
+                records.extend(_read_records(sys.stdin))
+            else:
+                with open(path) as stream:
+                    records.extend(_read_records(stream))
+    except (IOError, ValueError, csv.Error) as exc:
+        logging.error("Could not read the hosts to import: " + str(exc))
+        sys.exit(1)
+
+    try:
+        res = interface.bulk_create_hosts(records)
+    except (models.AddressNotInPoolError,
+            models.AddressNotAvailableError,
+            models.FullPoolError,
+            interface.DuplicateObjectError,
+            interface.InexistantObjectError,
+            interface.MissingParameterError,
+            interface.PropertyFormatError) as exc:
+        logging.error(str(exc))
+        sys.exit(1)
+
+    for hostres, addrres in res:
+        if addrres is None:
+            print("Host \"" + hostres + "\" have been created.")
+        else:
+            print("Assigned " + addrres + " to host " + hostres)
+
+
 def delete(args):
     """Delete an object from the database."""
     if args.generator:
@@ -501,6 +577,18 @@ def set_(args):
         sys.exit(1)
 
 
+def check_maps(args):
+    """Check the allocation maps of the pools against their addresses."""
+    try:
+        pools = interface.check_alloc_maps(args.pool_name)
+    except interface.InexistantObjectError as exc:
+        logging.error(str(exc))
+        sys.exit(1)
+
+    for pool in pools:
+        print("Rebuilt inconsistent allocation map of pool " + pool.name)
+
+
 def list_logs(args):
     """View log entries."""
     for entry in models.LogEntry.objects.all().order_by("date"):
@@ -570,6 +658,10 @@ def run_cli():
         list_logs(args)
     elif args.action == "export":
         print(interface.export(cmd))
+    elif args.action == "checkmap":
+        check_maps(args)
+    elif args.action == "import":
+        import_(args)
     else: # "list"
         list_(args)
 
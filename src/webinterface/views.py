@@ -99,17 +99,7 @@ def login(request):
 @login_required
 def list_pools(request):
     """List available pools in the database."""
-    poolobjs = models.Pool.objects.all().order_by("name")
-    pools = []
-    for poolobj in poolobjs:
-        addr_used = models.Address.objects.filter(pool=poolobj).count()
-        addr_avail = poolobj.len()
-        try:
-            pools.append((poolobj,
-                addr_used, addr_avail, addr_used * 100 / addr_avail))
-        except ZeroDivisionError:
-            pools.append((poolobj,
-                addr_used, addr_avail, 100))
+    pools = interface.pool_stats()
 
     if request.GET.get("format") == "json":
         return render_to_response("pool_list.json",
@@ -207,8 +197,7 @@ def pool_info(request, pool_name):
         elif request.GET.get("sort") == "mac":
             addrs = addrs.order_by("macaddr")
         else:
-            addrs = list(addrs)
-            addrs = interface.sort_addresses(addrs)
+            addrs = addrs.order_by_addr()
         templ_values = {"request": request,
             "pool": poolobj,
             "addr_used": addr_used,
@@ -233,15 +222,19 @@ def pool_map(request, pool_name):
     if addr_avail == 0:
         addr_avail = 1
     pool_addrs = models.Address.objects.filter(pool=poolobj)
-    i = POOL_MAP_LIMIT
-    for addr in poolobj.addr_range:
-        if i == 0:
-            break
-        if poolobj.isallocated(addr):
-            addrs.append(pool_addrs.get(addr=addr))
-        else:
-            addrs.append(models.Address(addr=addr, pool=None, host=None))
-        i -= 1
+    alloc_map = poolobj.get_alloc_map()
+    displayed = [poolobj.addr_range[i]
+        for i in xrange(min(POOL_MAP_LIMIT, poolobj.len()))]
+    # fetch the allocated addresses of the map at once, by batches to respect
+    # the limit of query parameters of some databases
+    used = [addr for i, addr in enumerate(displayed) if i in alloc_map]
+    allocated = {}
+    for i in xrange(0, len(used), 500):
+        for addrobj in pool_addrs.filter(addr__in=used[i:i + 500]):
+            allocated[addrobj.addr] = addrobj
+    for addr in displayed:
+        addrs.append(allocated.get(addr,
+            models.Address(addr=addr, pool=None, host=None)))
     templ_values = {"request": request,
         "pool": poolobj,
         "addrs": addrs,
@@ -282,7 +275,7 @@ def list_hosts(request):
     else:
         hosts = models.Host.objects.all()
         if request.GET.get("sort") == "addr":
-            hosts = hosts.order_by("address__addr")
+            hosts = hosts.order_by("address__addr_key", "address__addr")
         elif request.GET.get("sort") == "alias":
             hosts = hosts.order_by( "alias__name")
         elif request.GET.get("sort") == "mac":
@@ -292,7 +285,7 @@ def list_hosts(request):
 
     host_list = []
     for host in hosts:
-        addrs = models.Address.objects.filter(host=host).order_by("addr")
+        addrs = models.Address.objects.filter(host=host).order_by_addr()
         host_list.append((host, addrs))
 
     context_values = {"request": request, "host_list": host_list,
@@ -392,15 +385,12 @@ def add_host(request):
             _("Created host %(host)s") % {"host": hoststr}, msg,
             referer="/host/" + hoststr)
     else:
-        categories = []
-        for pools in models.Pool.objects.exclude(category=""):
-            for cat in pools.category.split(","):
-                if cat not in categories:
-                    categories.append(cat)
+        categories = models.Category.objects.filter(pool__isnull=False
+            ).distinct().order_by("name").values_list("name", flat=True)
         context_values = {"request": request,
             "pools": [pool.name for pool in
                 models.Pool.objects.all().order_by("name")],
-            "categories": sorted(categories)}
+            "categories": list(categories)}
         return render_to_response("add_host.html", context_values)
 
 
@@ -490,7 +480,7 @@ def host_info(request, host_name):
             _("The address %(addr)s has correctly been allocated to host "
                 "%(host)s.") % {"addr": addr.addr, "host": host.name})
     else:
-        addrs = models.Address.objects.filter(host=host).order_by("addr")
+        addrs = models.Address.objects.filter(host=host).order_by_addr()
         if request.method == "DELETE":
             if data.get("confirm"):
                 return render_to_response("host.html", {"request": request,
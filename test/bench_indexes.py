@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Benchmark of the address lookups before and after the index migration.
+
+It creates a temporary database, migrates it to the schema without indexes,
+fills it with 100k hosts and addresses and times the lookups done by the
+interface, then applies the index migration and times them again::
+
+    python test/bench_indexes.py [nb_addresses]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "..", "src"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webinterface.settings")
+
+from django.conf import settings
+
+DB_FD, DB_PATH = tempfile.mkstemp(suffix=".db")
+os.close(DB_FD)
+settings.DATABASES["default"] = {
+    "ENGINE": "django.db.backends.sqlite3",
+    "NAME": DB_PATH,
+}
+
+import django
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection, transaction
+
+POOL_SIZE = 250
+NB_LOOKUPS = 500
+
+LOOKUPS = [
+    ("Address by addr",
+        "SELECT id FROM slam_address WHERE addr = %s", ("addr",)),
+    ("Address by pool/allocated/addr",
+        "SELECT id FROM slam_address WHERE pool_id = %s AND allocated = %s "
+        "AND addr = %s", ("pool", "allocated", "addr")),
+    ("Address by macaddr",
+        "SELECT id FROM slam_address WHERE macaddr = %s", ("mac",)),
+    ("Host by name",
+        "SELECT id FROM slam_host WHERE name = %s", ("host",)),
+    ("Alias by name",
+        "SELECT id FROM slam_alias WHERE name = %s", ("alias",)),
+    ("Property by host/name",
+        "SELECT value FROM slam_property WHERE host_id = %s AND name = %s",
+        ("hostid", "prop")),
+]
+
+
+def fill(nb_addr):
+    """Insert *nb_addr* hosts each with an address, an alias and a
+    property."""
+    nb_pools = (nb_addr + POOL_SIZE - 1) // POOL_SIZE
+    with transaction.atomic():
+        cursor = connection.cursor()
+        cursor.executemany("INSERT INTO slam_pool (id, name, category, "
+            "addr_range_type, addr_range_str, dns_record, alloc_map_str) "
+            "VALUES (%s, %s, '', 'ip4', %s, 'A', NULL)",
+            [(i + 1, "pool" + str(i), "10." + str(i // 256) + "."
+                + str(i % 256) + ".0/24") for i in range(nb_pools)])
+        cursor.executemany("INSERT INTO slam_host (id, name, category, serial, "
+            "inventory, nodns) VALUES (%s, %s, '', '', '', 0)",
+            [(i + 1, "host" + str(i)) for i in range(nb_addr)])
+        cursor.executemany("INSERT INTO slam_address (addr, macaddr, "
+            "allocated, pool_id, host_id, date, comment) VALUES "
+            "(%s, %s, 1, %s, %s, '2015-01-01 00:00:00', '')",
+            [(addr(i), mac(i), i // POOL_SIZE + 1, i + 1)
+                for i in range(nb_addr)])
+        cursor.executemany("INSERT INTO slam_alias (aliastype, name, host_id) "
+            "VALUES ('name', %s, %s)",
+            [("alias" + str(i), i + 1) for i in range(nb_addr)])
+        cursor.executemany("INSERT INTO slam_property (name, value, host_id) "
+            "VALUES ('building', %s, %s)",
+            [(str(i), i + 1) for i in range(nb_addr)])
+
+
+def addr(i):
+    """Return the address of the host number *i*."""
+    pool = i // POOL_SIZE
+    return ("10." + str(pool // 256) + "." + str(pool % 256) + "."
+        + str(i % POOL_SIZE))
+
+
+def mac(i):
+    """Return the MAC address of the host number *i*."""
+    return "00:00:00:%02x:%02x:%02x" % (i >> 16, (i >> 8) & 255, i & 255)
+
+
+def bench(nb_addr):
+    """Return the mean latency in microseconds of each lookup."""
+    rand = random.Random(42)
+    samples = [rand.randrange(nb_addr) for _ in range(NB_LOOKUPS)]
+    values = {
+        "addr": addr,
+        "pool": lambda i: i // POOL_SIZE + 1,
+        "allocated": lambda i: True,
+        "mac": mac,
+        "host": lambda i: "host" + str(i),
+        "alias": lambda i: "alias" + str(i),
+        "hostid": lambda i: i + 1,
+        "prop": lambda i: "building",
+    }
+    cursor = connection.cursor()
+    res = []
+    for name, query, params in LOOKUPS:
+        start = time.time()
+        for i in samples:
+            cursor.execute(query, [values[param](i) for param in params])
+            assert cursor.fetchone() is not None
+        res.append((name, (time.time() - start) / NB_LOOKUPS * 1e6))
+    return res
+
+
+def main():
+    nb_addr = 100000
+    if len(sys.argv) > 1:
+        nb_addr = int(sys.argv[1])
+    try:
+        call_command("migrate", verbosity=0)
+        call_command("migrate", "slam", "0002", verbosity=0)
+        fill(nb_addr)
+        before = bench(nb_addr)
+        start = time.time()
+        call_command("migrate", "slam", "0003", verbosity=0)
+        migrate_time = time.time() - start
+        after = bench(nb_addr)
+    finally:
+        os.unlink(DB_PATH)
+
+    print("Lookup latency with " + str(nb_addr) + " addresses (us/query):")
+    print("%-32s %12s %12s" % ("lookup", "before", "after"))
+    for (name, old), (_, new) in zip(before, after):
+        print("%-32s %12.1f %12.1f" % (name, old, new))
+    print("Index migration took %.1f s" % migrate_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Test module for the allocation map of the pools.
+"""
+
+from slam.allocmap import AllocMap
+
+
+def test_allocmap():
+    amap = AllocMap()
+    assert str(amap) == "" and amap.len() == 0
+    for offset in [0, 1, 2, 5, 7, 6]:
+        amap.add(offset)
+    assert str(amap) == "0-2,5-7" and amap.len() == 6
+    assert 1 in amap and 6 in amap
+    assert 3 not in amap and 8 not in amap
+    amap.add(3)
+    amap.add(4)
+    assert str(amap) == "0-7" and amap.len() == 8
+    amap.remove(4)
+    amap.remove(0)
+    amap.remove(42)
+    assert str(amap) == "1-3,5-7" and amap.len() == 6
+    assert AllocMap("1-3,5-7") == amap
+    assert AllocMap("1-3,5-8") != amap
+
+
+def test_allocmap_free():
+    amap = AllocMap("0-2,5,7-9")
+    assert amap.first_free(16) == 3
+    assert amap.first_free(16, 4) == 4
+    assert amap.first_free(16, 5) == 6
+    assert amap.first_free(10, 8) is None
+    assert AllocMap("0-3").first_free(4) is None
+    assert [amap.nth_free(i) for i in range(6)] == [3, 4, 6, 10, 11, 12]
+    assert AllocMap("0-" + str(2 ** 64)).first_free(2 ** 128) == 2 ** 64 + 1
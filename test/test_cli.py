@@ -178,6 +178,10 @@ def test_create():
     args = slam_cli.parse_args(ap, "-a get -H host2 -pn test2".split())
     slam_cli.get(args)
     assert Address.objects.filter(host__name="host2").count() == 3
+    args = slam_cli.parse_args(ap,
+        "-a get -H host2 -pn test2 --hint 10.50.50.50".split())
+    slam_cli.get(args)
+    assert Address.objects.get(addr="10.50.50.51").host.name == "host2"
 
     assert Address.objects.filter(addr="10.100.10.100").count() == 0
     args = slam_cli.parse_args(ap,
@@ -345,3 +349,70 @@ def test_property():
     assert_raises(SystemExit, slam_cli.set_, args)
     args = slam_cli.parse_args(ap, "-a setprop -pn inexistant foo=bar".split())
     assert_raises(SystemExit, slam_cli.set_, args)
+
+
+def test_checkmap():
+    saved_out = sys.stdout
+    ap = slam_cli.init_argparser()
+
+    args = slam_cli.parse_args(ap,
+        "-a create -pn map-pool -p 10.251.0.0/24".split())
+    slam_cli.create(args)
+    args = slam_cli.parse_args(ap, "-a get -pn map-pool -H hostprop".split())
+    slam_cli.get(args)
+    Pool.objects.filter(name="map-pool").update(alloc_map_str="")
+
+    sys.stdout = StringIO.StringIO()
+    args = slam_cli.parse_args(ap, "-a checkmap -pn map-pool".split())
+    slam_cli.check_maps(args)
+    assert (sys.stdout.getvalue()
+        == "Rebuilt inconsistent allocation map of pool map-pool\n")
+    sys.stdout = StringIO.StringIO()
+    args = slam_cli.parse_args(ap, "-a checkmap -pn map-pool".split())
+    slam_cli.check_maps(args)
+    assert sys.stdout.getvalue() == ""
+    sys.stdout = saved_out
+
+    args = slam_cli.parse_args(ap, "-a checkmap -pn inexistant".split())
+    assert_raises(SystemExit, slam_cli.check_maps, args)
+
+
+def test_import():
+    saved_out = sys.stdout
+    saved_in = sys.stdin
+    ap = slam_cli.init_argparser()
+
+    args = slam_cli.parse_args(ap,
+        "-a create -pn import-pool -p 10.252.0.0/24".split())
+    slam_cli.create(args)
+
+    sys.stdin = StringIO.StringIO("host,pool,address,alias,nodns\n"
+        "import-1,import-pool,,\"ialias-1,ialias-2\",\n"
+        "import-2,import-pool,10.252.0.42,,yes\n")
+    sys.stdout = StringIO.StringIO()
+    args = slam_cli.parse_args(ap, "-a import".split())
+    slam_cli.import_(args)
+    assert sys.stdout.getvalue() == ("Assigned 10.252.0.0 to host import-1\n"
+        "Assigned 10.252.0.42 to host import-2\n")
+    assert Host.objects.get(name="import-2").nodns
+    assert Host.objects.get(name="import-1").alias_set.count() == 2
+
+    sys.stdin = StringIO.StringIO('{"host": "import-3", "mac": "mac-3"}\n'
+        '{"host": "import-4", "pool": "import-pool", "alias": ["ialias-4"]}\n')
+    sys.stdout = StringIO.StringIO()
+    args = slam_cli.parse_args(ap, "-a import -".split())
+    slam_cli.import_(args)
+    assert sys.stdout.getvalue() == ("Host \"import-3\" have been created.\n"
+        "Assigned 10.252.0.1 to host import-4\n")
+
+    sys.stdin = StringIO.StringIO("host,pool\nimport-5,import-pool\n"
+        "import-1,import-pool\n")
+    args = slam_cli.parse_args(ap, "-a import".split())
+    assert_raises(SystemExit, slam_cli.import_, args)
+    assert not Host.objects.filter(name="import-5")
+    sys.stdin = StringIO.StringIO('{"host": "import-5"\n')
+    assert_raises(SystemExit, slam_cli.import_, args)
+    args = slam_cli.parse_args(ap, "-a import /inexistant/hosts.csv".split())
+    assert_raises(SystemExit, slam_cli.import_, args)
+    sys.stdout = saved_out
+    sys.stdin = saved_in
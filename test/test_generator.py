@@ -2,8 +2,9 @@
 Test module for the configuration generator.
 """
 
-import StringIO, sys, os, datetime, tempfile
+import StringIO, sys, os, datetime, tempfile, shutil
 from nose.tools import assert_raises
+from django.test.utils import override_settings
 
 from slam import generator, models
 
@@ -191,6 +192,49 @@ def test_update():
     orig.close()
     os.unlink(path)
 
+def test_unchanged():
+    tmpdir = tempfile.mkdtemp()
+    hdrpath = os.path.join(tmpdir, "header")
+    open(hdrpath, "w").write("@ 1D IN SOA foo bar 1970032801 a b c d\n")
+    path = os.path.join(tmpdir, "zone")
+    today = datetime.date.today().strftime("%Y%m%d")
+
+    host1 = models.Host(name="host1")
+    host2 = models.Host(name="host2")
+    addr1 = models.Address(addr="addr", pool=models.Pool(dns_record="A"))
+    addr2 = models.Address(addr="rdda", pool=models.Pool(dns_record="A"))
+
+    def run(hosts, update=False):
+        conf = generator.BindConfig.create(outputfile=path, header=hdrpath)
+        conf.load()
+        if update:
+            conf.updateconf([(None, hosts)])
+        else:
+            conf.createconf([(None, hosts)])
+        conf.output.close()
+        return conf.unchanged
+
+    assert not run([(host1, addr1, [], "")])
+    content = open(path).read()
+    assert today + "01" in content
+    assert run([(host1, addr1, [], "")])
+    assert open(path).read() == content
+    assert sorted(os.listdir(tmpdir)) == ["header", "zone"]
+
+    assert not run([(host1, addr1, [], ""), (host2, addr2, [], "")])
+    content = open(path).read()
+    assert "host2" in content and today + "01" in content
+    assert len(os.listdir(tmpdir)) == 3
+    assert run([(host1, addr1, [], ""), (host2, addr2, [], "")], True)
+    assert open(path).read() == content
+    assert not run([(host1, addr1, [], "")], True)
+    assert today + "02" in open(path).read()
+
+    for name in os.listdir(tmpdir):
+        os.unlink(os.path.join(tmpdir, name))
+    os.rmdir(tmpdir)
+
+
 def _generator_checkfile(cls, content):
     handle, path = tempfile.mkstemp()
     checkf = open(path, "w")
@@ -269,3 +313,283 @@ def test_checkfile():
     _generator_checkfile(generator.QuattorConfig,
         "escape(\"test\"),\"1.2.3.4\"\n"
         + "escape(\"host2\"),\"1.2.2.2\"")
+
+
+def test_checkfile_index():
+    handle, path = tempfile.mkstemp()
+    checkf = open(path, "w")
+    checkf.write("host2.domain\t1d\tin\ta\tother\n"
+        + "; host1\t1d\tin\ta\taddr\n"
+        + "host3\t1d\tin\ta\taddr\n")
+    checkf.close()
+
+    host1 = models.Host(name="host1")
+    host2 = models.Host(name="host2")
+    addr1 = models.Address(addr="addr", pool=models.Pool(dns_record="A"))
+    addr2 = models.Address(addr="rdda", pool=models.Pool(dns_record="A"))
+
+    conf = generator.BindConfig.create(outputfile="-", checkfile=[path])
+    conf.load()
+    dup = conf.is_unique([(host1, addr1, [], ""), (host2, addr2, [], ""),
+        (host2, addr1, [], "")])
+    assert dup == [(host2, path, 1), (host2, path, 1), (host1, path, 3),
+        (host2, path, 3)]
+    # the checkfile is only parsed once for all the pools
+    os.unlink(path)
+    assert conf.is_unique([(host1, addr1, [], "")]) == [(host1, path, 3)]
+
+    handle, path = tempfile.mkstemp()
+    checkf = open(path, "w")
+    checkf.write("host other { hardware ethernet 00:11:22:33:44:55; }\n")
+    checkf.close()
+    addr1.macaddr = "00:11:22:33:44:55"
+    conf = generator.DhcpdConfig.create(outputfile="-", checkfile=[path])
+    conf.load()
+    assert conf.is_unique([(host1, addr1, [], ""), (host2, addr2, [], "")]) == [
+        (host1, path, 1)]
+    os.unlink(path)
+
+
+def test_checkfile_cache():
+    tmpdir = tempfile.mkdtemp()
+    cachepath = os.path.join(tmpdir, "cache")
+    paths = []
+    for i in range(3):
+        paths.append(os.path.join(tmpdir, "zone" + str(i)))
+        open(paths[-1], "w").write("host1\t1d\tin\ta\taddr" + str(i) + "\n")
+    host1 = models.Host(name="host1")
+    addr1 = models.Address(addr="addr", pool=models.Pool(dns_record="A"))
+
+    parsed = []
+
+    def check(files):
+        conf = generator.BindConfig.create(outputfile="-", checkfile=files)
+        conf.load()
+        parse = conf._parse_checkfile
+        def counting_parse(filename):
+            parsed.append(filename)
+            return parse(filename)
+        conf._parse_checkfile = counting_parse
+        return conf.is_unique([(host1, addr1, [], "")])
+
+    with override_settings(CHECKFILE_CACHE=cachepath, CHECKFILE_CACHE_SIZE=2):
+        assert check(paths[:1]) == [(host1, paths[0], 1)]
+        assert check(paths[:1]) == [(host1, paths[0], 1)]
+        assert parsed == [paths[0]]
+
+        # a hit only reads the entry of the file, it does not write the cache
+        entries = os.listdir(cachepath)
+        check(paths[:1])
+        assert os.listdir(cachepath) == entries and parsed == [paths[0]]
+
+        # a modified file is parsed again
+        open(paths[0], "w").write("\nhost1\t1d\tin\ta\taddr\n")
+        assert check(paths[:1]) == [(host1, paths[0], 2)]
+        assert parsed == [paths[0]] * 2
+
+        # the least recently used file is evicted
+        check(paths[1:])
+        assert parsed == [paths[0]] * 2 + paths[1:]
+        check(paths[2:] + paths[:1])
+        assert parsed == [paths[0]] * 2 + paths[1:] + [paths[0]]
+
+        # the records of another version of the parser are not used
+        generator.CHECKFILE_FORMAT += 1
+        try:
+            check(paths[:1])
+        finally:
+            generator.CHECKFILE_FORMAT -= 1
+        assert parsed == [paths[0]] * 2 + paths[1:] + [paths[0]] * 2
+
+    with override_settings(CHECKFILE_CACHE=""):
+        check(paths[2:])
+        assert parsed[-1] == paths[2]
+
+    for dirpath, _, files in os.walk(tmpdir, topdown=False):
+        for name in files:
+            os.unlink(os.path.join(dirpath, name))
+        os.rmdir(dirpath)
+
+
+def test_streaming():
+    class CountingOutput(StringIO.StringIO):
+        writes = 0
+        def write(self, str_):
+            self.writes += 1
+            StringIO.StringIO.write(self, str_)
+
+    nbhosts = generator.WRITE_BATCH * 2 + 1
+    pool = models.Pool(dns_record="A")
+    hosts = [(models.Host(name="host" + str(i)),
+            models.Address(addr="10.0." + str(i // 256) + "." + str(i % 256),
+                pool=pool), [], "")
+        for i in range(nbhosts)]
+
+    conf = generator.LalDnsConfig.create(outputfile=None)
+    conf.output = CountingOutput()
+    conf.generate(hosts)
+    assert conf.output.writes == 3
+    lines = conf.output.getvalue().splitlines()
+    assert len(lines) == nbhosts
+    assert lines[0] == "10.0.0.0\thost0\t"
+    assert lines[-1] == ("10.0." + str((nbhosts - 1) // 256) + "."
+        + str((nbhosts - 1) % 256) + "\thost" + str(nbhosts - 1) + "\t")
+
+    # header and footer files are copied without being split in lines
+    hdr = StringIO.StringIO("header1\nheader2\n")
+    out = CountingOutput()
+    conf.output = out
+    conf.gen_header(hdr)
+    assert out.getvalue() == "header1\nheader2\n"
+    assert out.writes == 1
+
+
+def test_atomic_output():
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "hosts")
+    host1 = models.Host(name="host1")
+    addr1 = models.Address(addr="addr", pool=models.Pool(dns_record="A"))
+
+    conf = generator.QuattorConfig.create(outputfile=path)
+    conf.load()
+    assert conf.output is None and not os.path.exists(path)
+    conf.createconf([(None, [(host1, addr1, [], "")])])
+    assert 'escape("host1"),"addr",\n' in open(path).read()
+    assert os.listdir(tmpdir) == ["hosts"]
+
+    os.chmod(path, 0640)
+    orig = os.stat(path)
+    reader = open(path)
+    content = reader.read()
+    conf = generator.QuattorConfig.create(outputfile=path)
+    conf.load()
+    conf.createconf([(None, [])])
+    conf.output.close()
+
+    # the file is replaced, a reader keeps the complete previous version
+    stat = os.stat(path)
+    assert stat.st_ino != orig.st_ino
+    assert stat.st_mode == orig.st_mode
+    assert "host1" not in open(path).read()
+    reader.seek(0)
+    assert reader.read() == content
+    reader.close()
+
+    # the backup is the previous file itself
+    backups = [name for name in os.listdir(tmpdir) if name != "hosts"]
+    assert len(backups) == 1 and backups[0].startswith("hosts-")
+    assert os.stat(os.path.join(tmpdir, backups[0])).st_ino == orig.st_ino
+    for name in os.listdir(tmpdir):
+        os.unlink(os.path.join(tmpdir, name))
+
+    # a symbolic link is kept and the file it points to keeps its owner
+    os.mkdir(os.path.join(tmpdir, "real"))
+    target = os.path.join(tmpdir, "real", "hosts")
+    open(target, "w").write(content)
+    os.symlink(target, path)
+    if os.getuid() == 0:
+        os.chown(target, 4242, 4343)
+    conf = generator.QuattorConfig.create(outputfile=path)
+    conf.load()
+    conf.createconf([(None, [])])
+    conf.output.close()
+    assert os.path.islink(path) and "host1" not in open(target).read()
+    if os.getuid() == 0:
+        assert (os.stat(target).st_uid, os.stat(target).st_gid) == (4242, 4343)
+    backup = [name for name in os.listdir(tmpdir) if name.startswith("hosts-")]
+    assert "host1" in open(os.path.join(tmpdir, backup[0])).read()
+
+    # the file is written in place when it cannot be replaced
+    conf = generator.QuattorConfig.create(outputfile=target)
+    conf.load()
+    rendered = StringIO.StringIO(content)
+    orig = os.stat(target)
+    conf._overwrite_output(rendered, target)
+    conf.output.close()
+    assert os.stat(target).st_ino == orig.st_ino and "host1" in open(
+        target).read()
+
+    shutil.rmtree(tmpdir)
+
+
+def test_update_splice():
+    host1 = models.Host(name="host1")
+    addr1 = models.Address(addr="addr", pool=models.Pool(dns_record="A"))
+    section = "#" + SLAM_HDR1 + "#" + SLAM_HDR2
+    record = 'escape("host1"),"addr",\n'
+
+    def update(content):
+        conf = generator.QuattorConfig.create(outputfile=None)
+        conf.output = StringIO.StringIO(content)
+        conf.updateconf([(None, [(host1, addr1, [], "")])])
+        return conf.output.getvalue()
+
+    # markers inside a line are not the section
+    assert (update("HDR x" + section + "old\n#" + SLAM_FTR + "FTR")
+        == "HDR x" + section + "old\n#" + SLAM_FTR + "FTR" + record)
+    assert (update("HDR\n" + section + "old\n#" + SLAM_FTR + "FTR")
+        == "HDR\n" + section + record + "#" + SLAM_FTR + "FTR")
+    # without end marker the old content is dropped
+    assert update(section + "old\n") == section + record
+    assert update("") == record
+
+    conf = generator.QuattorConfig.create(outputfile=None)
+    assert (conf._strip_slam_section("a\n" + section + "b\n#" + SLAM_FTR
+        + "c\n") == "a\n\n\n\n\nc\n")
+    assert conf._strip_slam_section("a\n" + section) == "a\n" + section
+
+
+def test_revbind_zones():
+    assert (generator._reverse_ip4(0xc0a8321e)
+        == "30.50.168.192.in-addr.arpa.")
+    assert (generator._reverse_ip6(0x20010db8 << 96 | 0xabc)
+        == "c.b.a.0." + "0." * 20 + "8.b.d.0.1.0.0.2.ip6.arpa.")
+
+    tmpdir = tempfile.mkdtemp()
+    pool4 = models.Pool(addr_range_type="ip4", dns_record="A")
+    pool6 = models.Pool(addr_range_type="ip6", dns_record="AAAA")
+    hosts = [
+        (models.Host(name="host1"), models.Address(addr="10.1.2.3",
+            pool=pool4), [], ""),
+        (models.Host(name="host2"), models.Address(addr="10.1.3.4",
+            pool=pool4), [], ""),
+        (models.Host(name="host3"), models.Address(addr="10.1.2.5",
+            pool=pool4), [], ""),
+        (models.Host(name="host4"), models.Address(addr="2001:db8:1::1",
+            pool=pool6), [], "")]
+
+    def run(update=False):
+        conf = generator.RevBindConfig.create(timeout="1D",
+            outputfile=os.path.join(tmpdir, "db.{zone}"))
+        conf.load()
+        if update:
+            conf.updateconf([(None, hosts)])
+        else:
+            conf.createconf([(None, hosts)])
+        return conf.unchanged
+
+    with override_settings(REVBIND_IP6_ZONE_PREFIX=48):
+        assert not run()
+        zone6 = "1.0.0.0.8.b.d.0.1.0.0.2.ip6.arpa"
+        assert (sorted(os.listdir(tmpdir))
+            == ["db." + zone6, "db.2.1.10.in-addr.arpa",
+                "db.3.1.10.in-addr.arpa"])
+        content = open(os.path.join(tmpdir, "db.2.1.10.in-addr.arpa")).read()
+        assert content.endswith(
+            "3.2.1.10.in-addr.arpa.\t1D\tIN\tPTR\thost1\n"
+            + "5.2.1.10.in-addr.arpa.\t1D\tIN\tPTR\thost3\n;" + SLAM_FTR)
+        content = open(os.path.join(tmpdir, "db." + zone6)).read()
+        assert "1." + "0." * 19 + zone6 + ".\t1D\tIN\tPTR\thost4\n" in content
+        assert run(True)
+
+        # the file of a zone without addresses left is emptied, not forgotten
+        del hosts[1]
+        assert not run(True)
+        content = open(os.path.join(tmpdir, "db.3.1.10.in-addr.arpa")).read()
+        assert "PTR" not in content and content.endswith(";" + SLAM_FTR)
+        assert run(True)
+        assert run()
+
+    for name in os.listdir(tmpdir):
+        os.unlink(os.path.join(tmpdir, name))
+    os.rmdir(tmpdir)
@@ -2,9 +2,11 @@
 
 import os, tempfile, datetime
 from nose.tools import assert_raises
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
 
 from slam.models import Pool, Host, Address, Property
-from slam import interface, generator
+from slam import interface, generator, models
 
 def test_getcreate_host():
     interface.create_host(host="host10")
@@ -66,6 +68,61 @@ def test_getcreate_host():
     assert hostobj.nodns
 
 
+def test_bulk_create_hosts():
+    interface.create_pool("pool16", "198.51.16.0/24", ["cat16"])
+    interface.create_host("host16-0", pool=interface.get_pool("pool16"))
+    res = interface.bulk_create_hosts([
+        {"host": "host16-1", "pool": "pool16"},
+        {"host": "host16-2", "address": "198.51.16.1", "mac": "mac16-2",
+            "alias": ["alias16-2", "alias16-2b"]},
+        {"host": "host16-3", "category": "cat16", "duration": 2},
+        {"host": "host16-4", "mac": "mac16-4", "serial": "serial16-4",
+            "nodns": True}])
+    assert res == [("host16-1", "198.51.16.2"), ("host16-2", "198.51.16.1"),
+        ("host16-3", "198.51.16.3"), ("host16-4", None)]
+    host = interface.get_host("alias16-2b")
+    assert str(host) == "host16-2"
+    assert host.address_set.get().macaddr == "mac16-2"
+    assert host.address_set.get().addr_key.endswith("c6331001")
+    assert interface.get_host("host16-3").category == "cat16"
+    assert interface.get_host("host16-3").address_set.get().duration
+    host = interface.get_host("host16-4")
+    assert host.serial == "serial16-4" and host.nodns
+    assert host.address_set.get().addr == ""
+    pool = interface.get_pool("pool16")
+    assert pool.alloc_map_str == "0-3"
+    assert pool.rebuild_alloc_map()
+
+    # nothing is created if one of the records is invalid
+    assert_raises(interface.DuplicateObjectError, interface.bulk_create_hosts,
+        [{"host": "host16-5"}, {"host": "host16-1"}])
+    assert_raises(interface.DuplicateObjectError, interface.bulk_create_hosts,
+        [{"host": "host16-5"}, {"host": "host16-6", "alias": ["host16-5"]}])
+    assert_raises(interface.MissingParameterError,
+        interface.bulk_create_hosts, [{"host": "host16-5"}, {"pool": "pool16"}])
+    assert_raises(interface.PropertyFormatError, interface.bulk_create_hosts,
+        [{"host": "host 16"}])
+    assert_raises(interface.InexistantObjectError,
+        interface.bulk_create_hosts, [{"host": "host16-5", "pool": "pool16b"}])
+    assert_raises(models.AddressNotInPoolError, interface.bulk_create_hosts,
+        [{"host": "host16-5", "pool": "pool16", "address": "10.17.0.1"}])
+    assert_raises(models.AddressNotAvailableError,
+        interface.bulk_create_hosts,
+        [{"host": "host16-5", "pool": "pool16"},
+            {"host": "host16-6", "address": "198.51.16.4"},
+            {"host": "host16-7", "address": "198.51.16.4"}])
+    assert_raises(models.FullPoolError, interface.bulk_create_hosts,
+        [{"host": "host16-r" + str(i), "pool": "pool16"} for i in range(253)])
+    assert not Host.objects.filter(name__startswith="host16-r").count()
+    assert not Host.objects.filter(name="host16-5").count()
+    assert interface.get_pool("pool16").alloc_map_str == "0-3"
+
+    res = interface.bulk_create_hosts([{"host": "host16-r" + str(i),
+        "pool": "pool16", "random": True} for i in range(252)])
+    assert len(set([addr for _, addr in res])) == 252
+    assert interface.get_pool("pool16").alloc_map_str == "0-255"
+
+
 def test_macaddress():
     interface.create_pool("pool15", "10.15.0.0/24")
     interface.create_host(host="host15-1")
@@ -83,6 +140,47 @@ def test_macaddress():
     assert Address.objects.get(host__name="host15-4").macaddr == "mac-4"
 
 
+def test_allocation_strategies():
+    interface.create_pool("pool48", "10.48.0.0/24")
+    interface.create_pool("pool48-6", "2001:db8:48::/64", ["cat48"])
+    assert interface.create_host("host48-1", hint="10.48.0.10") == (
+        "host48-1", "10.48.0.10")
+    assert interface.create_host("host48-2", hint="10.48.0.10") == (
+        "host48-2", "10.48.0.11")
+    assert_raises(models.AddressNotInPoolError, interface.create_host,
+        "host48-3", hint="203.0.113.48")
+
+    eui64 = "2001:0db8:0048:0000:0225:96ff:fe12:3456"
+    assert interface.create_host("host48-4", mac="00:25:96:12:34:56",
+        category="cat48", eui64=True) == ("host48-4", eui64)
+    assert Address.objects.get(addr=eui64).macaddr == "00:25:96:12:34:56"
+    assert_raises(models.FullPoolError, interface.create_host, "host48-5",
+        mac="00:25:96:12:34:56", category="cat48", eui64=True)
+    assert_raises(models.AddressNotInPoolError, interface.create_host,
+        "host48-6", pool=interface.get_pool("pool48"),
+        mac="00:25:96:12:34:57", eui64=True)
+
+    # the MAC address of the host is used by default
+    interface.create_host("host48-7", mac="00:25:96:12:34:58")
+    addr = interface.allocate_address(interface.get_pool("pool48-6"),
+        interface.get_host("host48-7"), eui64=True)
+    assert str(addr) == "2001:0db8:0048:0000:0225:96ff:fe12:3458"
+    assert addr.macaddr == "00:25:96:12:34:58"
+    assert_raises(interface.MissingParameterError,
+        interface.allocate_address, interface.get_pool("pool48-6"),
+        interface.get_host("host48-1"), eui64=True)
+
+    res = interface.bulk_create_hosts([
+        {"host": "host48-8", "hint": "10.48.0.10"},
+        {"host": "host48-9", "pool": "pool48-6", "mac": "00:25:96:12:34:59",
+            "eui64": True}])
+    assert res == [("host48-8", "10.48.0.12"),
+        ("host48-9", "2001:0db8:0048:0000:0225:96ff:fe12:3459")]
+    assert_raises(interface.MissingParameterError,
+        interface.bulk_create_hosts,
+        [{"host": "host48-10", "pool": "pool48-6", "eui64": True}])
+
+
 def test_getcreate_pool():
     interface.create_pool("pool20", "10.20.0.0/24", ["cat20"])
     assert(str(interface.get_pool(pool_name="pool20"))
@@ -104,6 +202,85 @@ def test_getcreate_pool():
         interface.create_pool, "pool20-3")
 
 
+def test_pool_stats():
+    interface.create_pool("pool21-1", "10.21.1.0/24")
+    interface.create_pool("pool21-2", "10.21.2.0/30")
+    interface.create_pool("pool21-3", "fe80:21::/64")
+    for i in range(3):
+        interface.create_host(host="host21-" + str(i),
+            pool=interface.get_pool("pool21-2"))
+    pools = Pool.objects.filter(name__startswith="pool21-").order_by("name")
+    with CaptureQueriesContext(connection) as queries:
+        stats = interface.pool_stats(pools)
+    assert len(queries) == 1
+    assert [(pool.name, used, tot, perc) for pool, used, tot, perc in stats] == [
+        ("pool21-1", 0, 256, 0), ("pool21-2", 3, 4, 75),
+        ("pool21-3", 0, 2 ** 64, 0)]
+
+
+def test_category_pools():
+    interface.create_pool("pool24-1", "198.51.24.0/30", ["cat24"])
+    interface.create_pool("pool24-2", "198.51.25.0/29", ["cat24", "cat24-2"])
+    assert (set(Pool.objects.get(name="pool24-2").categories.values_list(
+        "name", flat=True)) == set(["cat24", "cat24-2"]))
+    interface.create_host(host="host24-0", pool=interface.get_pool("pool24-2"))
+
+    # the most used pool is filled first, then the other ones
+    assert ([pool.name for pool in interface.category_pools("cat24")]
+        == ["pool24-2", "pool24-1"])
+    for i in range(1, 8):
+        interface.create_host(host="host24-" + str(i), category="cat24")
+    assert Address.objects.filter(pool__name="pool24-2").count() == 8
+    interface.create_host(host="host24-8", category="cat24")
+    assert Address.objects.get(host__name="host24-8").pool.name == "pool24-1"
+
+    with override_settings(POOL_CATEGORY_STRATEGY="least-full"):
+        assert interface.get_pool(category="cat24").name == "pool24-1"
+
+    interface.modify(["pool24-2"], category=["cat24-3"])
+    assert ([pool.name for pool in interface.category_pools("cat24")]
+        == ["pool24-1"])
+    assert interface.get_pool(category="cat24-3").name == "pool24-2"
+    assert_raises(interface.InexistantObjectError,
+        interface.get_pool, None, "cat24-2")
+
+
+def test_category_full_pools():
+    interface.create_pool("pool49-1", "198.51.49.0/30", ["cat49"])
+    interface.create_pool("pool49-2", "198.51.50.0/29", ["cat49"])
+    for i in range(4):
+        interface.create_host(host="host49-" + str(i),
+            pool=interface.get_pool("pool49-1"))
+
+    for strategy in ["fill-first", "least-full"]:
+        with override_settings(POOL_CATEGORY_STRATEGY=strategy):
+            assert ([pool.name for pool in interface.category_pools("cat49")]
+                == ["pool49-2", "pool49-1"])
+            assert interface.get_pool(category="cat49").name == "pool49-2"
+            name = "host49-" + strategy
+            interface.create_host(host=name, category="cat49")
+            assert Address.objects.get(host__name=name).pool.name == "pool49-2"
+            res = interface.bulk_create_hosts([{"host": name + "-bulk",
+                "category": "cat49"}])
+            assert res[0][1].startswith("198.51.50.")
+
+    # bulk allocations spill over to the next pool of the category
+    interface.create_pool("pool49-3", "198.51.51.0/29", ["cat49"])
+    res = interface.bulk_create_hosts([{"host": "host49-r" + str(i),
+        "category": "cat49"} for i in range(8)])
+    assert [addr for _, addr in res] == ["198.51.50." + str(i)
+        for i in range(4, 8)] + ["198.51.51." + str(i) for i in range(4)]
+    with override_settings(POOL_CATEGORY_STRATEGY="least-full"):
+        interface.create_host(host="host49-s0", pool=interface.get_pool(
+            "pool49-3"))
+        res = interface.bulk_create_hosts([{"host": "host49-s1",
+            "category": "cat49"}])
+        assert res == [("host49-s1", "198.51.51.5")]
+    assert_raises(models.FullPoolError, interface.bulk_create_hosts,
+        [{"host": "host49-x" + str(i), "category": "cat49"} for i in range(3)])
+    assert not Host.objects.filter(name__startswith="host49-x").count()
+
+
 def test_modify():
     interface.create_pool("pool30-1", "10.30.1.0/24")
 
@@ -231,6 +408,250 @@ def test_generate():
     os.unlink(path)
 
 
+def test_generate_queries():
+    interface.create_pool("pool41", "10.41.0.0/24")
+    interface.create_host(host="host41-0", pool=interface.get_pool("pool41"))
+
+    def count_queries():
+        with CaptureQueriesContext(connection) as queries:
+            interface.generate(None, ["pool41"], "laldns", "-", update=False)
+        return len(queries)
+
+    before = count_queries()
+    for i in range(1, 10):
+        interface.create_host(host="host41-" + str(i),
+            pool=interface.get_pool("pool41"), alias=["alias41-" + str(i)])
+        interface.set_prop("mx", "mx41-" + str(i), host="host41-" + str(i))
+    assert count_queries() == before
+
+    # all the default generators share a single load of the hosts
+    defaults = list(generator.Config.objects.filter(default=True))
+    generator.Config.objects.update(default=False)
+    paths = []
+    for conftype in ["laldns", "quattor"]:
+        paths.append(tempfile.mkstemp()[1])
+        interface.create_generator("gen41-" + conftype, conftype, paths[-1],
+            True, pools=["pool41"])
+    with CaptureQueriesContext(connection) as queries:
+        interface.generate(update=False)
+    assert len([query for query in queries.captured_queries
+        if "FROM \"slam_address\"" in query["sql"]]) == 1
+    for path in paths:
+        assert "host41-9" in open(path).read()
+        os.unlink(path)
+    generator.Config.objects.filter(name__startswith="gen41-").delete()
+    for gen in defaults:
+        gen.default = True
+        gen.save()
+
+
+def test_generate_jobs():
+    interface.create_pool("pool42", "10.42.0.0/24")
+    for i in range(5):
+        interface.create_host(host="host42-" + str(i),
+            pool=interface.get_pool("pool42"), alias=["alias42-" + str(i)])
+
+    defaults = list(generator.Config.objects.filter(default=True))
+    generator.Config.objects.update(default=False)
+    paths = []
+    for conftype in ["laldns", "quattor"]:
+        paths.append(tempfile.mkstemp()[1])
+        os.chmod(paths[-1], 0644)
+        interface.create_generator("gen42-" + conftype, conftype, paths[-1],
+            True, pools=["pool42"])
+
+    interface.generate(update=False)
+    serial = [open(path).read() for path in paths]
+    assert "alias42-4" in serial[0] and "host42-4" in serial[1]
+    interface.generate(update=False, jobs=2)
+    assert [open(path).read() for path in paths] == serial
+    assert os.stat(paths[0]).st_mode & 0777 == 0644
+
+    # the content around the generated section is kept on update
+    open(paths[0], "w").write("before\n" + serial[0] + "after\n")
+    interface.create_host(host="host42-5", pool=interface.get_pool("pool42"))
+    interface.generate(update=True, jobs=2)
+    res = open(paths[0]).read()
+    assert res.startswith("before\n") and res.endswith("after\n")
+    assert "host42-5" in res and "host42-5" in open(paths[1]).read()
+
+    # the transaction of the caller is kept
+    with transaction.atomic():
+        interface.create_host(host="host42-6", pool=interface.get_pool(
+            "pool42"))
+        interface.generate(update=True, jobs=2)
+        assert Host.objects.filter(name="host42-6").count() == 1
+    assert "host42-6" in open(paths[0]).read()
+
+    for path in paths:
+        for name in os.listdir(os.path.dirname(path)):
+            if name.startswith(os.path.basename(path) + "-"):
+                os.unlink(os.path.join(os.path.dirname(path), name))
+        os.unlink(path)
+    generator.Config.objects.filter(name__startswith="gen42-").delete()
+    for gen in defaults:
+        gen.default = True
+        gen.save()
+
+
+def test_generate_journal():
+    interface.create_pool("pool43", "10.43.0.0/24")
+    interface.create_pool("pool43b", "10.43.1.0/24")
+    interface.create_host(host="host43-1", pool=interface.get_pool("pool43"))
+    path = tempfile.mkstemp()[1]
+    interface.create_generator("gen43", "laldns", path, pools=["pool43"])
+    interface.generate("gen43", update=False)
+    assert interface.get_generator("gen43").revision
+
+    def mark():
+        content = open(path).read()
+        open(path, "w").write(content.replace("host43-1", "host43-x"))
+
+    # nothing changed in the pools of the generator: the file is left as is
+    mark()
+    interface.create_host(host="host43-2", pool=interface.get_pool("pool43b"))
+    interface.generate("gen43")
+    assert "host43-x" in open(path).read()
+
+    interface.set_prop("mx", "mx43", host="host43-1")
+    interface.generate("gen43")
+    res = open(path).read()
+    assert "host43-x" not in res and "mx43" in res
+
+    mark()
+    interface.generate("gen43")
+    assert "host43-x" in open(path).read()
+    interface.modify(host="host43-1", alias=["alias43"])
+    interface.generate("gen43")
+    assert "alias43" in open(path).read()
+
+    # a new configuration of the generator or a deleted pool renders again
+    for change in [
+            lambda: interface.modify_generator("gen43", timeout="2H"),
+            lambda: interface.delete(pool=interface.get_pool("pool43b"))]:
+        mark()
+        change()
+        interface.generate("gen43")
+        assert "host43-x" not in open(path).read()
+
+    # an edited check file renders again once, even if the output is unchanged
+    checkfile = tempfile.mkstemp()[1]
+    interface.modify_generator("gen43", checkfile=[checkfile])
+    interface.generate("gen43")
+    mark()
+    interface.generate("gen43")
+    assert "host43-x" in open(path).read()
+    open(checkfile, "w").write("other43 IN A 10.43.2.1\n")
+    interface.generate("gen43")
+    assert "host43-x" not in open(path).read()
+    mark()
+    interface.generate("gen43")
+    assert "host43-x" in open(path).read()
+    os.unlink(checkfile)
+
+    for name in os.listdir(os.path.dirname(path)):
+        if name.startswith(os.path.basename(path)):
+            os.unlink(os.path.join(os.path.dirname(path), name))
+
+
+def test_generate_restricted():
+    interface.create_pool("pool43c", "10.43.3.0/24")
+    interface.create_pool("pool43d", "10.43.4.0/24")
+    path = tempfile.mkstemp()[1]
+    interface.create_generator("gen43r", "laldns", path)
+    interface.generate("gen43r", update=False)
+    revision = interface.get_generator("gen43r").revision
+
+    # an update of some of the pools does not stamp the generator
+    interface.create_host(host="host43-c1", pool=interface.get_pool("pool43c"))
+    interface.create_host(host="host43-d1", pool=interface.get_pool("pool43d"))
+    interface.generate("gen43r", ["pool43c"])
+    assert interface.get_generator("gen43r").revision == revision
+    interface.generate("gen43r")
+    res = open(path).read()
+    assert "host43-c1" in res and "host43-d1" in res
+    assert interface.get_generator("gen43r").revision > revision
+
+    # the entries rendered by every generator are dropped from the journal
+    oldest = min(generator.Config.objects.filter(revision__isnull=False
+        ).values_list("revision", flat=True))
+    pool_entry = models.ChangeEntry.objects.filter(kind="pool").latest("id")
+    interface.delete_changes()
+    assert list(models.ChangeEntry.objects.filter(id__lt=oldest).exclude(
+        id=pool_entry.id)) == []
+    assert models.ChangeEntry.objects.filter(id=pool_entry.id).exists()
+    assert models.ChangeEntry.objects.filter(id__gte=oldest).exists()
+    interface.create_host(host="host43-d2", pool=interface.get_pool("pool43d"))
+    interface.generate("gen43r")
+    assert "host43-d2" in open(path).read()
+
+    generator.Config.objects.filter(name="gen43r").delete()
+    for name in os.listdir(os.path.dirname(path)):
+        if name.startswith(os.path.basename(path)):
+            os.unlink(os.path.join(os.path.dirname(path), name))
+
+
+def test_generate_zones():
+    interface.create_pool("pool47", "10.47.0.0/24")
+    interface.create_host(host="host47-1", pool=interface.get_pool("pool47"))
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "db.0.47.10.in-addr.arpa")
+    interface.create_generator("gen47", "revbind",
+        os.path.join(tmpdir, "db.{zone}"), pools=["pool47"])
+    interface.generate("gen47", update=False)
+    assert "host47-1" in open(path).read()
+
+    # the zone files of an up to date generator are left as is
+    content = open(path).read()
+    open(path, "w").write(content.replace("host47-1", "host47-x"))
+    interface.generate("gen47")
+    assert "host47-x" in open(path).read()
+    interface.create_host(host="host47-2", pool=interface.get_pool("pool47"))
+    interface.generate("gen47")
+    assert "host47-x" not in open(path).read()
+
+    for name in os.listdir(tmpdir):
+        os.unlink(os.path.join(tmpdir, name))
+    os.rmdir(tmpdir)
+
+
+@generator.register
+class ZoneConfig(generator.Config):
+    """Site-specific generator registered by the tests."""
+
+    type_ = "tzone"
+    format_ = "testzone"
+
+    class Meta(models.SLAMBaseModel.Meta):
+        proxy = True
+
+    def records(self, hosts):
+        for host, addr, _, _ in hosts:
+            yield str(addr) + " " + host.name + "\n"
+
+
+def test_generator_registry():
+    interface.create_pool("pool44", "10.44.0.0/24")
+    interface.create_host(host="host44-0", pool=interface.get_pool("pool44"))
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+
+    gen = interface.create_generator("gen44", "testzone", path,
+        pools=["pool44"])
+    assert isinstance(gen, ZoneConfig) and gen.conftype == "tzone"
+    with CaptureQueriesContext(connection) as queries:
+        gen = interface.get_generator("gen44")
+    assert len(queries) == 1
+    assert isinstance(gen, ZoneConfig)
+    assert isinstance(interface.get_generator("dnsgen2"), generator.BindConfig)
+
+    interface.generate("gen44", update=False)
+    assert "10.44.0.0 host44-0\n" in open(path).read()
+
+    generator.Config.objects.filter(name="gen44").delete()
+    os.unlink(path)
+
+
 def test_delete():
     interface.create_pool("pool50", "10.50.0.0/24")
     interface.create_host(host="host50-1", pool=interface.get_pool("pool50"))
@@ -3,6 +3,8 @@ Test module for the pool class in SLAM.
 """
 
 from nose.tools import assert_raises
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from slam import addrrange, models
 
@@ -18,7 +20,7 @@ def test_pool():
     p.save()
     p = models.Pool.objects.get(name="setnet1")
     p._update()
-    assert p.addr_range.addr_set == set(["addr1", "addr2", "addr3"])
+    assert list(p.addr_range) == ["addr1", "addr2", "addr3"]
 
     ips = models.Pool.create(definition="")
     assert ips.addr_range_type == "set"
@@ -75,6 +77,48 @@ def test_pool_get_rand():
     assert_raises(models.FullPoolError, p.get_rand)
 
 
+def test_pool_get_rand_seed():
+    p = models.Pool.create("localnet19", definition="192.168.19.0/24")
+    p.save()
+    for i in range(0, 256, 2):
+        p.allocate("192.168.19." + str(i))
+    with CaptureQueriesContext(connection) as first_queries:
+        addr = str(p.get_rand(seed=42))
+    p.free(addr)
+    assert str(p.get_rand(seed=42)) == addr
+    # only odd addresses are left
+    for i in range(126):
+        assert int(str(p.get_rand()).split(".")[3]) % 2 == 1
+    with CaptureQueriesContext(connection) as queries:
+        p.get_rand()
+    assert len(queries) == len(first_queries)
+    assert_raises(models.FullPoolError, p.get_rand)
+
+
+def test_pool_get_ip6():
+    p = models.Pool.create("localnet24", definition="2001:db8:24::/64")
+    p.save()
+    hint = "2001:0db8:0024:0000:0000:0001:0000:0000"
+    assert str(p.get(hint)) == hint
+    assert str(p.get(hint)) == "2001:0db8:0024:0000:0000:0001:0000:0001"
+    last = "2001:0db8:0024:0000:ffff:ffff:ffff:ffff"
+    assert str(p.get(last)) == last
+    assert str(p.get(last)) == "2001:0db8:0024:0000:0000:0000:0000:0000"
+    assert_raises(models.AddressNotInPoolError, p.get, "2001:db8:25::1")
+
+    addr = p.get_eui64("00:25:96:12:34:56")
+    assert str(addr) == "2001:0db8:0024:0000:0225:96ff:fe12:3456"
+    assert_raises(models.AddressNotAvailableError, p.get_eui64,
+        "00:25:96:12:34:56")
+    assert str(p.get_rand()) in p.addr_range
+    assert p.used() == 6
+
+    p = models.Pool.create("localnet25", definition="192.168.25.0/24")
+    p.save()
+    assert_raises(models.AddressNotInPoolError, p.get_eui64,
+        "00:25:96:12:34:56")
+
+
 def test_pool_allocate():
     p = models.Pool.create("localnet20", definition="192.168.20.0/24")
     p.save()
@@ -179,3 +223,134 @@ def test_addr_not_allocated():
     p.free("192.168.80.0")
     assert_raises(models.AddressNotAllocatedError, p.free, "192.168.80.0")
     assert_raises(models.AddressNotAllocatedError, p.free, "192.168.80.42")
+
+
+def test_pool_get_queries():
+    p = models.Pool.create("localnet90", definition="192.168.90.0/24")
+    p.save()
+    with CaptureQueriesContext(connection) as empty_queries:
+        assert str(p.get()) == "192.168.90.0"
+    for i in range(1, 200):
+        p.allocate("192.168.90." + str(i))
+    with CaptureQueriesContext(connection) as queries:
+        assert str(p.get()) == "192.168.90.200"
+    assert len(queries) == len(empty_queries)
+
+
+def test_alloc_map():
+    p = models.Pool.create("localnet95", definition="192.168.95.0/24")
+    p.save()
+    p.get()
+    p.allocate("192.168.95.42")
+    host = models.Host(name="host95")
+    host.save()
+    p.allocate("192.168.95.1", host)
+    assert models.Pool.objects.get(pk=p.pk).alloc_map_str == "0-1,42"
+    assert p.used() == 3
+
+    # the Pool methods only store their map, they do not invalidate it first
+    for action in [p.free, p.allocate]:
+        with CaptureQueriesContext(connection) as queries:
+            action("192.168.95.42")
+        assert len([query for query in queries.captured_queries
+            if "UPDATE \"slam_pool\"" in query["sql"]]) == 1
+    assert p.get_alloc_map() is p.alloc_map and p.used() == 3
+
+    # deleting the host invalidates the map which is rebuilt on the next use
+    host.delete()
+    p = models.Pool.objects.get(pk=p.pk)
+    assert p.alloc_map_str is None
+    assert not p.isallocated("192.168.95.1")
+    assert models.Pool.objects.get(pk=p.pk).alloc_map_str == "0,42"
+
+    models.Pool.objects.filter(pk=p.pk).update(alloc_map_str="0-10")
+    p = models.Pool.objects.get(pk=p.pk)
+    assert not p.rebuild_alloc_map()
+    assert p.rebuild_alloc_map()
+    assert str(p.get()) == "192.168.95.1"
+
+
+def test_pool_allocate_race():
+    p = models.Pool.create("localnet96", definition="192.168.96.0/24")
+    p.save()
+    # another allocator inserted the address but its map is not visible yet
+    models.Address(addr="192.168.96.3", allocated=True, pool=p).save()
+    models.Pool.objects.filter(pk=p.pk).update(alloc_map_str="")
+    p = models.Pool.objects.get(pk=p.pk)
+    assert_raises(models.AddressNotAvailableError, p.allocate, "192.168.96.3")
+    assert models.Address.objects.filter(addr="192.168.96.3").count() == 1
+    assert str(p.get()) == "192.168.96.0"
+    # the other allocator would have stored its map
+    assert not p.rebuild_alloc_map()
+    assert p.rebuild_alloc_map()
+
+    # addresses missing from the map are skipped, and added to it
+    models.Address.objects.bulk_create([models.Address(addr=addr,
+        allocated=True, pool=p) for addr in ["192.168.96.1", "192.168.96.2"]])
+    assert [str(p.get()) for _ in range(2)] == ["192.168.96.4",
+        "192.168.96.5"]
+    assert models.Pool.objects.get(pk=p.pk).alloc_map_str == "0-5"
+    p = models.Pool.create("localnet97", definition="192.168.97.0/30")
+    p.save()
+    models.Address.objects.bulk_create([models.Address(addr="192.168.97."
+        + str(i), allocated=True, pool=p) for i in [0, 1, 3]])
+    assert str(p.get_rand()) == "192.168.97.2"
+    assert_raises(models.FullPoolError, p.get_rand)
+    assert p.rebuild_alloc_map()
+
+
+def test_pool_reserve():
+    p = models.Pool.create("localnet94", definition="192.168.94.0/30")
+    p.save()
+    models.Address(addr="192.168.94.1", allocated=True, pool=p).save()
+    p = models.Pool.objects.get(pk=p.pk)
+    p.lock()
+    assert p.reserve("192.168.94.2") == "192.168.94.2"
+    assert_raises(models.AddressNotAvailableError, p.reserve, "192.168.94.2")
+    assert_raises(models.AddressNotInPoolError, p.reserve, "192.168.93.2")
+    assert_raises(models.AddressNotInPoolError, p.reserve,
+        hint="192.168.93.2")
+    assert p.reserve(hint="192.168.94.1") == "192.168.94.3"
+    assert p.reserve(rand=True) == "192.168.94.0"
+    assert_raises(models.FullPoolError, p.reserve)
+    # the reservations are only stored on request
+    assert models.Pool.objects.get(pk=p.pk).alloc_map_str != "0-3"
+    p.save_reservations()
+    assert models.Pool.objects.get(pk=p.pk).alloc_map_str == "0-3"
+
+
+def test_address_key():
+    assert addrrange.addr_key("10.0.0.1") == "0" * 24 + "0a000001"
+    assert addrrange.addr_key("2001:db8::1") == "20010db8" + "0" * 23 + "1"
+    assert addrrange.addr_key("not an address") is None
+
+    p = models.Pool.create("localnet97", definition="192.168.97.0/24")
+    p.save()
+    for i in [10, 9, 100, 2]:
+        p.allocate("192.168.97." + str(i))
+    addrs = models.Address.objects.filter(pool=p)
+    assert ([str(addr) for addr in addrs.order_by_addr()]
+        == ["192.168.97.2", "192.168.97.9", "192.168.97.10",
+            "192.168.97.100"])
+    assert ([str(addr) for addr in
+            addrs.between("192.168.97.9", "192.168.97.99").order_by_addr()]
+        == ["192.168.97.9", "192.168.97.10"])
+
+    p = models.Pool.create("localnet97-6", definition="2001:db8:97::/64")
+    p.save()
+    p.allocate("2001:db8:97::a")
+    p.allocate("2001:db8:97::9")
+    assert ([addrrange._parse_ip6(str(addr)) for addr in
+            models.Address.objects.filter(pool=p).order_by_addr()]
+        == [addrrange._parse_ip6("2001:db8:97::9"),
+            addrrange._parse_ip6("2001:db8:97::a")])
+
+
+def test_pool_range_cache():
+    p = models.Pool.create("localnet98", definition="192.168.98.0/24")
+    p.save()
+    p = models.Pool.objects.get(name="localnet98")
+    assert p.len() == 256
+    hits = addrrange.RANGE_CACHE.hits
+    assert (models.Pool.objects.get(name="localnet98").len() == 256
+        and addrrange.RANGE_CACHE.hits == hits + 1)
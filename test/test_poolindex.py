@@ -0,0 +1,73 @@
+"""
+Test module for the index of the pool ranges.
+"""
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from slam import addrrange, interface, models, poolindex
+from slam.poolindex import IntervalIndex, PoolIndex
+
+
+def test_interval_index():
+    index = IntervalIndex([(0, 255, 3), (16, 31, 1), (300, 400, 2),
+        (20, 23, 0), (401, 410, 2)])
+    assert zip(index.starts, index.ends, index.keys) == [(0, 15, 3),
+        (16, 19, 1), (20, 23, 0), (24, 31, 1), (32, 255, 3), (300, 410, 2)]
+    assert index.find(0) == 3
+    assert index.find(21) == 0
+    assert index.find(28) == 1
+    assert index.find(256) is None
+    assert index.find(410) == 2
+    assert index.find(411) is None
+    assert index.overlapping(250, 350) == set([2, 3])
+    assert index.overlapping(256, 299) == set()
+
+
+def test_pool_index():
+    index = PoolIndex([
+        (4, addrrange.Ip4Range("10.50.0.0/16")),
+        (2, addrrange.Ip4Range("10.50.1.0/24")),
+        (3, addrrange.Ip6Range("fe80::/64")),
+        (1, addrrange.AddrSet(set(["10.50.2.1", "name1"]))),
+    ])
+    assert index.find("10.50.1.12") == 2
+    assert index.find("10.50.2.1") == 1
+    assert index.find("10.50.2.2") == 4
+    assert index.find("fe80::42") == 3
+    assert index.find("name1") == 1
+    assert index.find("10.51.0.0") is None
+    assert index.find("name2") is None
+    assert index.overlapping(addrrange.Ip4Range("10.50.1.128/25")) == set([2])
+    assert index.overlapping(addrrange.Ip4Range("10.0.0.0/8")) == set([2, 4])
+    assert index.overlapping(addrrange.AddrSet(set(["name1", "fe80::1"]))
+        ) == set([1, 3])
+
+
+def test_find_pool():
+    interface.create_pool("poolindex1", "172.23.0.0/16")
+    interface.create_pool("poolindex2", "172.23.4.0/24")
+    assert poolindex.find_pool("172.23.4.1").name == "poolindex1"
+    assert poolindex.find_pool("172.24.4.1") is None
+    with CaptureQueriesContext(connection) as queries:
+        poolindex.get_index()
+    assert len(queries) == 1
+
+    interface.create_pool("poolindex3", "fd60::/64")
+    assert poolindex.find_pool("fd60::1").name == "poolindex3"
+    models.Pool.objects.filter(name="poolindex3").delete()
+    assert poolindex.find_pool("fd60::1") is None
+
+    addr = interface.allocate_address(None, address="172.23.4.2")
+    assert addr.pool.name == "poolindex1"
+
+    # another process replacing the pool with the highest id by a pool reusing
+    # this id, without the signals of this process
+    interface.create_pool("poolindex4", "fd61::/64")
+    assert poolindex.find_pool("fd61::1").name == "poolindex4"
+    pool_id = models.Pool.objects.get(name="poolindex4").pk
+    models.Pool.objects.filter(pk=pool_id).update(name="poolindex5",
+        addr_range_str="fd62:0000:0000:0000:0000:0000:0000:0000/64")
+    models.record_changes([pool_id], "pool", "poolindex5")
+    assert poolindex.find_pool("fd61::1") is None
+    assert poolindex.find_pool("fd62::1").name == "poolindex5"
@@ -24,6 +24,20 @@ def test_parse_ip4():
     assert_raises(InvalidAddressError, addrrange._parse_ip4, "192.168.256.0")
 
 
+def test_parse_ip4_many():
+    addrs = ["0.0.0.42", "1.3.3.7", u"192.168.255.23"]
+    assert (list(addrrange.parse_ip4_many(addrs))
+        == [42, 16974599, 3232300823])
+    # formats not accepted by inet_pton
+    assert addrrange._parse_ip4("010.001.0.42") == (10 << 24) + (1 << 16) + 42
+    assert (list(addrrange.parse_ip4_many(addrs + ["1.3.3.7/24"]))
+        == [42, 16974599, 3232300823, 16974599])
+    assert_raises(InvalidAddressError, addrrange.parse_ip4_many,
+        addrs + ["invalid"])
+    assert (addrrange.format_ip4_many(addrrange.parse_ip4_many(addrs))
+        == addrs)
+
+
 def test_ip4range():
     ipr = addrrange.Ip4Range("172.16.50.80/12")
     assert addrrange._format_ip4(ipr.net) == "172.16.0.0" and ipr.mask == 12
@@ -82,6 +96,15 @@ def test_parse_ip6():
         (42 << 112) + (0x1234 << 96) + (0x5678 << 16) + 0xabcd)
 
 
+def test_parse_ip6_many():
+    addrs = ["0000:0000:0000:0000:0000:0000:0000:002a",
+        "1234:5678:9abc:def1:2345:6789:abcd:ef12"]
+    ints = [42, 24197857203266734884469844682461802258]
+    assert addrrange.parse_ip6_many(addrs) == ints
+    assert addrrange.format_ip6_many(ints) == addrs
+    assert addrrange.parse_ip6_many(["2A::", "::ffff"]) == [42 << 112, 0xffff]
+
+
 def test_ip6range():
     ipr = addrrange.Ip6Range("fc42:0f00:0ba2:cafe:1234:1234:1234:1234/64")
     assert(addrrange._format_ip6(ipr.net) ==
@@ -100,6 +123,40 @@ def test_ip6range():
     assert_raises(IndexError, ipr.__getitem__, 262144)
 
 
+def test_ip6range_slice():
+    ipr = addrrange.Ip6Range("2001:db8::/64")
+    assert ipr
+    assert ipr.len() == 2 ** 64
+    assert_raises(OverflowError, len, ipr)
+    assert list(ipr[-2:]) == ["2001:0db8:0000:0000:ffff:ffff:ffff:fffe",
+        "2001:0db8:0000:0000:ffff:ffff:ffff:ffff"]
+    part = ipr[2 ** 32:2 ** 32 + 10:4]
+    assert part.len() == 3
+    assert part[1] == "2001:0db8:0000:0000:0000:0001:0000:0004"
+    assert list(part[1:]) == ["2001:0db8:0000:0000:0000:0001:0000:0004",
+        "2001:0db8:0000:0000:0000:0001:0000:0008"]
+    assert not ipr[5:5]
+
+    ipr = addrrange.Ip6Range("2001:db8::/63")
+    assert list(ipr.iter_from(2 ** 64 - 1, 2 ** 64 + 1)) == [
+        "2001:0db8:0000:0000:ffff:ffff:ffff:ffff",
+        "2001:0db8:0000:0001:0000:0000:0000:0000"]
+    assert list(addrrange.Ip4Range("10.0.0.0/29")[1::3]) == [
+        "10.0.0.1", "10.0.0.4", "10.0.0.7"]
+
+
+def test_ip6range_eui64():
+    ipr = addrrange.Ip6Range("2001:db8:0:1::/64")
+    assert (ipr.eui64("00:25:96:12:34:56")
+        == "2001:0db8:0000:0001:0225:96ff:fe12:3456")
+    assert (ipr.eui64("02-25-96-12-34-56")
+        == "2001:0db8:0000:0001:0025:96ff:fe12:3456")
+    assert_raises(addrrange.InvalidAddressError, ipr.eui64, "00:25:96")
+    ipr = addrrange.Ip6Range("2001:db8::/80")
+    assert_raises(addrrange.InvalidAddressError, ipr.eui64,
+        "00:25:96:12:34:56")
+
+
 def test_ip6range_contains():
     ipr = addrrange.Ip6Range("fc42:0f00:0ba2:cafe:1234:1234:efcd:1234/110")
     assert "fc42:0f00:0ba2:cafe:1234:1234:efcb:ffff" not in ipr
@@ -121,10 +178,53 @@ def test_addrset():
     addrs.add("1.2.3.4")
     addrs.add("127.0.0.1")
     assert "127.0.0.1" in addrs and "1.2.3.4" in addrs
-    addr = addrs.addr_set.pop()
-    assert addr == "127.0.0.1" or addr == "1.2.3.4"
+    addr = addrs[0]
+    assert addr == "1.2.3.4"
+    addrs.remove(addr)
     addrs.add("iamanaddress")
     assert addrs.len() == 2
     addrs.remove("iamanaddress")
     assert addrs.len() == 1
     assert_raises(IndexError, addrs.__getitem__, 2)
+    assert_raises(KeyError, addrs.remove, "iamanaddress")
+
+    addrs = addrrange.AddrSet(["host3", "host1", "host2", "host1"])
+    assert list(addrs) == ["host1", "host2", "host3"]
+    assert str(addrs) == "host1,host2,host3"
+    assert addrs[1] == "host2" and addrs.index("host3") == 2
+    addrs.add("host0")
+    assert addrs.index("host3") == 3 and "host0" in addrs
+    assert "host4" not in addrs
+    assert_raises(ValueError, addrs.index, "host4")
+
+    # the IP addresses are sorted in address order, before the other names
+    addrs = addrrange.AddrSet(["10.0.0.10", "host1", "10.0.0.2", "fe80::1"])
+    assert list(addrs) == ["10.0.0.2", "10.0.0.10", "fe80::1", "host1"]
+    assert addrs.index("10.0.0.10") == 1 and "10.0.0.02" not in addrs
+    copy = addrs.copy()
+    copy.add("10.0.0.3")
+    copy.remove("host1")
+    assert list(copy) == ["10.0.0.2", "10.0.0.3", "10.0.0.10", "fe80::1"]
+    assert list(addrs) == ["10.0.0.2", "10.0.0.10", "fe80::1", "host1"]
+
+
+def test_range_cache():
+    cache = addrrange.RangeCache(2)
+    ipr = cache.get("ip4", "10.1.0.0/24")
+    assert str(ipr) == "10.1.0.0/24"
+    assert cache.get("ip4", "10.1.0.0/24") is ipr
+    assert (cache.hits, cache.misses) == (1, 1)
+    addrs = cache.get("set", "addr1,addr2", "CNAME")
+    assert "addr2" in addrs and addrs.dns_record == "CNAME"
+    assert cache.get("set", "addr1,addr2") is not addrs
+    assert cache.evictions == 1
+    # the least recently used range was evicted, the sets are copies which do
+    # not modify the cached one
+    addrs.add("addr3")
+    addrs = cache.get("set", "addr1,addr2", "CNAME")
+    assert list(addrs) == ["addr1", "addr2"]
+    cache.get("ip6", "fe80::/64")
+    assert cache.get("ip4", "10.1.0.0/24") is not ipr
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 5, 3)
+    cache.clear()
+    assert (cache.hits, cache.misses, cache.evictions) == (0, 0, 0)